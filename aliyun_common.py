@@ -0,0 +1,2307 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+@desc: polarDB / mongodb exporter 共用组件
+1、collect_scheduler：后台采集调度
+  1.1 每个账号按自己的 interval（秒）定时采集，默认 60s
+  1.2 采集结果为该账号独立的 metrics_snapshot，采集完成后整体替换
+  1.3 /metrics 只输出内存中的快照，不再触发阿里云 api 调用
+  1.4 额外输出 aliyun_exporter_snapshot_timestamp_seconds（各账号快照的采集完成时间），
+      快照新旧程度为 time() - aliyun_exporter_snapshot_timestamp_seconds
+2、fetch_pool：有界线程池，并发执行节点/实例/监控项的性能查询
+  2.1 总并发由 max_workers 限制
+  2.2 单账号、单区域并发分别由 account_limit、region_limit 限制，超出时提交方阻塞等待
+3、paginate / inventory_cache：集群、实例清单
+  3.1 按 PageNumber/PageSize 翻页拉取全部条目，避免超过默认分页大小的部分丢失
+  3.2 清单按账号缓存，有效期 inventory_interval（秒）单独配置，默认 600s，
+      有效期内采集只复用缓存，不再调用清单接口
+  3.3 清单拉取后一次性解析为 account_topology（账号 → 集群 → 节点、账号 → 实例），
+      各实体使用 __slots__，重复出现的字符串（可用区、规格、状态等）通过 intern_text 共用，
+      后续分片、查询、生成 metrics 均使用该模型，不再重复解析原始返回值
+4、多账号、多区域并行采集
+  4.1 load_accounts 读取 yaml 配置，RegionId 为列表时按区域展开
+  4.2 每个账号独立线程采集，单次采集时长上限为 timeout（秒），默认等于 interval
+  4.3 单个账号失败只影响该账号，保留其上一次快照，
+      输出 aliyun_exporter_account_up / aliyun_exporter_account_collect_duration_seconds
+5、client_registry：常驻的 AcsClient
+  5.1 按 (accessKeyId, 区域) 复用同一个 AcsClient，其 http 连接池跨采集周期保持长连接
+  5.2 连接池大小与单账号并发数 account_limit 一致
+  5.3 超过 idle_timeout（秒）未使用的 client 关闭连接并移除
+  5.4 client 的所有请求经过 rate_limiter：按 (accessKeyId, action) 令牌桶限速，
+      Throttling 与临时性错误按带抖动的指数退避重试，被限流时降速、成功后逐步恢复
+6、metrics_snapshot：按采集周期生成的 metrics 快照
+  6.1 每个周期新建快照，完成后整体替换旧快照；
+      单个 metrics 的 label 取值与 value 以平行数组保存，不再使用 Gauge 对象
+  6.2 本周期未采到的 series 沿用上一次的值，超过 stale_ttl（秒，默认 300s）后过期删除，
+      已删除的集群、长时间失败的账号不会一直残留在 /metrics 中（过期在下一次渲染时生效）；
+      complete 的 family（由完整清单生成的状态、meta）每个周期完整输出，不沿用
+  6.3 snapshot_collector 作为自定义 Collector，/metrics 时由快照直接生成 GaugeMetricFamily
+  6.4 watermark_store 记录各节点/实例、监控项已取到的最新数据点时间，
+      下次查询窗口从该时间开始，只输出更新的数据点，并带上数据点自身的时间戳
+7、exposition_cache：/metrics 预渲染缓存
+  7.1 账号采集结束后标记需要重新渲染，由后台线程渲染文本，同时保存 gzip 压缩结果，请求时直接返回；
+      两次渲染之间至少间隔 render_interval 秒，期间完成的多个账号合并为一次渲染
+  7.2 支持 Accept-Encoding: gzip、openmetrics 格式（首次请求时渲染）、ETag/If-None-Match，
+      ETag 只由预渲染内容决定，text、openmetrics 格式各自计算，两次渲染之间的请求可以返回 304
+  7.3 快照时间、自身运行状态 metrics 一起预渲染，请求时不再渲染、压缩任何内容，
+      自身运行状态随预渲染更新（至少每个采集周期一次）
+8、推送模式（可选）：每个账号采集完成后主动推送，不再依赖 prometheus 拉取
+  8.1 remote_writer：本周期更新的 series 按 batch_size 分批编码为 remote write 请求，snappy 压缩后发送
+  8.2 pushgateway_pusher：按 (产品, 账号, 区域) 分组推送到 Pushgateway，PUT 整组替换
+  8.3 push_queue：推送请求进入有界队列，由 max_in_flight 个线程发送，限制同时进行的请求数，
+      队列满时丢弃最早的请求；失败按带抖动的指数退避重试
+9、shard_filter：多副本分片采集
+  9.1 --shard-index/--shard-count 指定本副本序号与副本总数，
+      (账号, 集群/实例 id) 通过带虚拟节点的一致性哈希环分配给唯一的副本
+  9.2 副本数变化时只有约 1/副本数 的集群/实例改变归属，各副本的 api 调用量与其分片大小成正比
+  9.3 推送模式下，Pushgateway 分组与 account_up 增加 shard label，避免副本之间互相覆盖
+10、product_collector：产品插件
+  10.1 每个产品（PolarDB、MongoDB 等）是一个插件类，提供：
+       product：产品名，job：默认 job 名，config_file：默认账号配置文件，
+       __init__(pool, inventory, clients, watermarks, shard, counters, schedule)，
+       collect(account, deadline)：采集单个账号，返回 metrics_snapshot
+  10.2 所有产品共用一个调度、线程池、client 仓库、清单缓存和 /metrics 服务，
+       快照、清单、account_up 按 (产品, 账号, 区域) 区分
+11、metric_mapping：yaml 声明的监控项与 metrics 对应关系
+  11.1 按 (Key, ValueFormat) 对应 metrics 名称、类型（gauge/counter）、单位和额外 label，
+       未指定 value_format 的条目匹配该 Key 的所有 ValueFormat
+  11.2 一个 Key 返回多个 ValueFormat（如 insert&query&update）时按 & 拆分，一次处理全部取值，
+       ValueFormat 可以写入 value_format_label 指定的 label
+  11.3 启动时编译为查找表，每个数据点只做一次字典查找；新增监控项只需修改 yaml 并重启
+  11.4 transform 指定跨周期计算，状态保存在 counter_store 中：
+       integrate：阿里云返回每秒平均值（如 MongoDB_Opcounters），查询窗口内比上次新的数据点逐点按相邻间隔累加，
+       输出 counter；
+       rate：阿里云返回累计值（如 MySQL Com_*），按相邻数据点计算每秒增量，输出 gauge，取值变小时视为重置；
+       超过 ttl（秒）没有新数据点的 series 删除其状态，间隔超过 max_gap（秒）的数据点只作为新的起点
+12、自身运行状态 metrics（self_registry，与快照一起预渲染，见 7.3）
+  12.1 aliyun_exporter_api_request_duration_seconds：阿里云 api 单次请求耗时，按 action、Key 区分，
+       batch_keys 合并多个 Key 的请求 key 为空，避免每种 Key 组合各占一组 series
+  12.2 aliyun_exporter_api_requests_total / api_errors_total / api_throttles_total：按账号、action 计数
+  12.3 aliyun_exporter_collect_phase_duration_seconds：最近一次采集各阶段耗时，
+       inventory（清单）、fetch（性能查询）、build（生成 metrics），pace（fetch_pool.map 分散提交的等待）；
+       分散提交的等待不计入 fetch 与 aliyun_exporter_account_collect_duration_seconds；
+       aliyun_exporter_render_duration_seconds：最近一次预渲染耗时
+  12.4 aliyun_exporter_pool_queued_tasks / pool_active_tasks：线程池排队中、执行中的请求数
+13、返回值解析
+  13.1 decode_response 直接解析 do_action_with_exception 返回的 bytes，已安装 orjson 时使用 orjson，
+       不再先转为 str
+  13.2 debug_response 只在开启 debug 日志时才解码返回值原文
+  13.3 性能接口的返回值在线程池中解析后只保留 performance_point（监控项、取值、时间），
+       完整的返回值不再跨线程传递、保存
+14、snapshot_store：快照落盘，重启后立即输出上一次的快照
+  14.1 每个账号采集完成后（最多每 save_interval 秒一次）将所有账号的快照、watermark_store、counter_store
+       以 marshal 格式写入本地文件，先写临时文件再替换，不会读到写了一半的文件
+  14.2 启动时读取该文件，快照立即可用于 /metrics 与 /ready，后台同时开始新的采集，
+       快照的采集完成时间保持原值，aliyun_exporter_snapshot_timestamp_seconds 反映其真实新旧程度，
+       超过 stale_ttl 的 series 照常过期
+  14.3 恢复的快照在该账号第一次采集成功前输出 aliyun_exporter_snapshot_restored=1
+  14.4 marshal 格式与 python 版本相关，文件头记录文件版本和写入时的 python 版本，
+       与当前不一致或文件损坏时忽略该文件，从空快照开始
+15、refresh_schedule：按监控项刷新
+  15.1 每个监控项可以单独配置刷新间隔（插件的 key_intervals），未配置的每个采集周期都查询，
+       变化慢的监控项（如磁盘使用量）不必每个周期消耗 api 配额，未到期时沿用上一次快照中的值
+  15.2 各节点/实例第一次查询后按节点/实例的哈希错开下次到期时间，节点/实例在整个间隔内均匀分布，
+       不会集中在同一个采集周期；同一节点/实例的各监控项对齐，批量模式下合并为一次请求
+  15.3 取值超过插件 hot_thresholds 的节点/实例标记为热点，保持 hot_hold 秒：
+       热点每个周期查询全部监控项，并排在线程池队列的最前面
+  15.4 插件的 cold_interval：非热点节点/实例中未单独配置间隔的监控项按该间隔刷新，
+       没有到期监控项的节点/实例本周期不发请求，api 调用次数随之减少，热点仍每个周期查询
+  15.5 fetch_pool.map 的 spread：本周期的请求在 spread 秒内均匀提交（热点在最前面），
+       不在周期开始时集中发出，账号的 fetch_spread 为占采集间隔的比例；等待时长记为 pace 阶段，见 12.3
+16、cardinality_policy：label 基数控制
+  16.1 按 metrics 名称配置 label 白名单（allow）、黑名单（deny），去掉的 label 不再区分 series，
+       同一 label 取值只保留最后一次写入
+  16.2 单个账号快照中每个 metrics 最多 max_series 个 series，超出的丢弃，
+       计入 aliyun_exporter_series_dropped_total
+  16.3 配置文件格式见 cardinality_policy，--cardinality-file 指定，--max-series 修改默认上限
+"""
+
+import os
+import sys
+import time
+import gzip
+import random
+import json
+import bisect
+import marshal
+import hashlib
+import logging
+import struct
+import threading
+import contextlib
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import yaml
+from aliyunsdkcore.client import AcsClient
+from aliyunsdkcore.acs_exception import error_code
+from aliyunsdkcore.acs_exception.exceptions import ClientException, ServerException
+from flask import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CollectorRegistry, CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.openmetrics.exposition import CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE
+from prometheus_client.openmetrics.exposition import generate_latest as openmetrics_latest
+
+try:
+    import orjson
+except ImportError:
+    # 未安装 orjson 时使用标准库 json，json.loads 同样可以直接解析 bytes
+    orjson = None
+
+try:
+    import snappy
+except ImportError:
+    # 未安装 python-snappy 时使用只封装格式、不压缩的实现
+    snappy = None
+
+
+DEFAULT_INTERVAL = 60
+DEFAULT_MAX_WORKERS = 32
+DEFAULT_ACCOUNT_LIMIT = 8
+DEFAULT_REGION_LIMIT = 16
+DEFAULT_INVENTORY_INTERVAL = 600
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_CLIENT_IDLE_TIMEOUT = 900
+DEFAULT_QPS = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BASE_DELAY = 0.5
+DEFAULT_RETRY_MAX_DELAY = 10
+DEFAULT_STALE_TTL = 300
+DEFAULT_MAX_LOOKBACK = 600
+DEFAULT_WATERMARK_TTL = 86400
+DEFAULT_COUNTER_TTL = 3600
+DEFAULT_SNAPSHOT_SAVE_INTERVAL = 10
+DEFAULT_RENDER_INTERVAL = 10
+DEFAULT_HOT_HOLD = 300
+DEFAULT_FETCH_SPREAD = 0.5
+DEFAULT_MAX_SERIES = 100000
+SNAPSHOT_FILE_VERSION = 2
+DEFAULT_PUSH_BATCH_SIZE = 2000
+DEFAULT_PUSH_MAX_IN_FLIGHT = 4
+DEFAULT_PUSH_QUEUE_SIZE = 100
+DEFAULT_PUSH_TIMEOUT = 30
+DEFAULT_SHARD_VNODES = 128
+
+
+def key_alias(key_id: str):
+    """
+    :param key_id: accessKeyId
+    :return: 不可逆的短别名，如 ak-1a2b3c4d，accessKeyId 不出现在 label、日志和线程名中
+    """
+    return "ak-" + hashlib.sha256(key_id.encode()).hexdigest()[:8]
+
+
+def account_key(account: dict):
+    """
+    :param account: 配置文件中的单个账号信息
+    :return: (账号名, 区域)，账号名未配置时使用 accessKeyId 的短别名
+    """
+    return account.get("name") or key_alias(account["accessKeyId"]), account["RegionId"]
+
+
+def collect_key(account: dict):
+    """
+    :param account: 账号信息，统一 exporter 中带有 product 字段
+    :return: (产品, 账号名, 区域)，同一账号下不同产品的快照、清单互不影响
+    """
+    return (account.get("product", ""),) + account_key(account)
+
+
+def load_accounts(config_file: str):
+    """
+    读取 yaml 配置文件中的账号信息，RegionId 可以是列表，按区域展开为多个账号
+    :param config_file: 配置文件路径，账号列表位于 config_file 字段下
+    :return: [账号信息, ...]
+    """
+    with open(config_file) as file:
+        content = yaml.safe_load(file)
+    accounts = []
+    for one_account in content.get("config_file") or []:
+        regions = one_account["RegionId"]
+        if isinstance(regions, str):
+            regions = [regions]
+        for region in regions:
+            accounts.append(dict(one_account, RegionId=region))
+    return accounts
+
+
+def decode_response(response: bytes):
+    """
+    :param response: do_action_with_exception 返回的原始数据
+    :return: 解析后的 json
+    """
+    if orjson is not None:
+        return orjson.loads(response)
+    return json.loads(response)
+
+
+def debug_response(action: str, response: bytes):
+    """
+    记录返回值原文，未开启 debug 日志时不解码、不拼接
+    :param action: 接口名，如 DescribeDBNodePerformance
+    :param response: do_action_with_exception 返回的原始数据
+    """
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"{action} 返回值： {response.decode('utf-8', 'replace')}")
+
+
+class performance_point:
+    __slots__ = ("key", "value", "timestamp", "value_format", "earlier")
+
+    def __init__(self, key: str, value, timestamp: float, value_format: str = "", earlier: tuple = ()):
+        """
+        性能接口返回值中单个监控项的最新数据点，取值在线程池中解析，之后的处理只会拿到数字
+        :param key: 监控项，PolarDB 为 MetricName，MongoDB 为 Key
+        :param value: PolarDB 为 float；MongoDB 为与 ValueFormat 一一对应的 float 元组，空取值为 None
+        :param timestamp: 数据点时间（单位：秒）
+        :param value_format: MongoDB 的 ValueFormat
+        :param earlier: 查询窗口内更早的数据点 ((取值, 数据点时间), ...)，按时间升序，
+            只有 transform 为 integrate 的监控项需要，用于逐点累加
+        """
+        self.key = key
+        self.value = value
+        self.timestamp = timestamp
+        self.value_format = value_format
+        self.earlier = earlier
+
+
+def paginate(client, request_class, items_path: tuple, page_size: int = DEFAULT_PAGE_SIZE, **params):
+    """
+    翻页拉取清单接口的全部条目
+    :param client: AcsClient 实例
+    :param request_class: 请求类，如 DescribeDBClustersRequest
+    :param items_path: 条目列表在返回值中的路径，如 ("Items", "DBCluster")
+    :param page_size: 每页条数
+    :param params: 其他请求参数，按 set_<参数名> 设置
+    :return: 全部条目列表
+    """
+    items = []
+    page_number = 1
+    while True:
+        request = request_class()
+        request.set_accept_format("json")
+        request.set_PageNumber(page_number)
+        request.set_PageSize(page_size)
+        for name, value in params.items():
+            getattr(request, "set_" + name)(value)
+
+        response = client.do_action_with_exception(request)
+        debug_response(request.get_action_name(), response)
+        res = decode_response(response)
+        page_items = res
+        for path in items_path:
+            page_items = page_items[path]
+        items.extend(page_items)
+
+        # 清单接口的总数字段名称不统一；有总数时以总数为准，没有总数时才以不满一页判断最后一页，
+        # 返回空页时结束，避免总数有误时死循环
+        total = res.get("TotalRecordCount", res.get("TotalCount"))
+        if total is None:
+            if len(page_items) < page_size:
+                return items
+        elif len(items) >= int(total) or not page_items:
+            return items
+        page_number += 1
+
+
+class inventory_cache:
+    """
+    按账号缓存清单，过期后重新拉取；拉取失败时沿用过期的缓存
+    """
+
+    def __init__(self, default_ttl: int = DEFAULT_INVENTORY_INTERVAL):
+        self.default_ttl = default_ttl
+        # {(产品, 账号名, 区域): (清单, 拉取时间)}
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, account: dict, loader):
+        """
+        :param account: 账号信息，可以单独配置 inventory_interval
+        :param loader: 无参函数，返回最新清单，返回 None 视为拉取失败
+        :return: 清单
+        """
+        key = collect_key(account)
+        ttl = int(account.get("inventory_interval", self.default_ttl))
+        with self._lock:
+            cached = self._items.get(key)
+        if cached is not None and time.time() - cached[1] < ttl:
+            return cached[0]
+
+        try:
+            inventory = loader()
+        except Exception as e:
+            if cached is None:
+                raise
+            logging.error(f"账号 {key} 清单刷新失败，沿用上一次缓存： {e}")
+            return cached[0]
+        if inventory is None:
+            if cached is None:
+                raise RuntimeError(f"账号 {key} 清单拉取失败！")
+            logging.error(f"账号 {key} 清单刷新失败，沿用上一次缓存")
+            return cached[0]
+
+        with self._lock:
+            self._items[key] = (inventory, time.time())
+        return inventory
+
+
+def intern_text(value):
+    """
+    :param value: 清单中重复出现的字段，如可用区、规格、状态
+    :return: 字符串时返回 intern 后的同一对象，其他类型原样返回
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+class account_topology:
+    __slots__ = ("clusters", "instances", "_owned")
+
+    def __init__(self, clusters: tuple = (), instances: tuple = ()):
+        """
+        单个账号、区域的清单，由产品插件在拉取清单时一次性构建，随 inventory_cache 缓存
+        :param clusters: 集群列表，每个集群带有 cluster_id、nodes，如 aliyun_polardb.polardb_cluster
+        :param instances: 实例列表，每个实例带有 instance_id，如 aliyun_mongodb.mongodb_instance
+        """
+        self.clusters = tuple(clusters)
+        self.instances = tuple(instances)
+        # (分片序号, 分片总数, 账号名, 分片后的清单)，清单缓存有效期内分片结果不变
+        self._owned = None
+
+    def nodes(self):
+        """
+        :return: [(集群, 节点), ...]，按集群顺序展开
+        """
+        return [(cluster, node) for cluster in self.clusters for node in cluster.nodes]
+
+    def owned(self, shard, account: str):
+        """
+        :param shard: shard_filter 实例
+        :param account: 账号名
+        :return: 本副本负责的集群/实例组成的清单，集群下所有节点由同一副本采集
+        """
+        if shard.shard_count == 1:
+            return self
+        owned = self._owned
+        if owned is not None and owned[:3] == (shard.shard_index, shard.shard_count, account):
+            return owned[3]
+        topology = account_topology(
+            [cluster for cluster in self.clusters if shard.owns(account, cluster.cluster_id)],
+            [instance for instance in self.instances if shard.owns(account, instance.instance_id)],
+        )
+        self._owned = (shard.shard_index, shard.shard_count, account, topology)
+        return topology
+
+
+# 自身运行状态 metrics，与快照一起预渲染
+self_registry = CollectorRegistry(auto_describe=True)
+api_request_duration = Histogram(
+    "aliyun_exporter_api_request_duration_seconds",
+    "latency of a single aliyun api request, retries are observed separately",
+    ["action", "key"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    registry=self_registry,
+)
+api_requests = Counter(
+    "aliyun_exporter_api_requests",
+    "aliyun api requests, including retries",
+    ["account", "action"],
+    registry=self_registry,
+)
+api_errors = Counter(
+    "aliyun_exporter_api_errors",
+    "failed aliyun api requests, including retried ones",
+    ["account", "action", "code"],
+    registry=self_registry,
+)
+api_throttles = Counter(
+    "aliyun_exporter_api_throttles",
+    "aliyun api requests rejected by throttling",
+    ["account", "action"],
+    registry=self_registry,
+)
+collect_phase_duration = Gauge(
+    "aliyun_exporter_collect_phase_duration_seconds",
+    "duration of each phase of the last collection of the account",
+    ["product", "account", "region", "phase"],
+    registry=self_registry,
+)
+render_duration = Gauge(
+    "aliyun_exporter_render_duration_seconds",
+    "duration of the last pre-rendering of /metrics",
+    registry=self_registry,
+)
+pool_queued_tasks = Gauge(
+    "aliyun_exporter_pool_queued_tasks",
+    "requests submitted to the fetch pool and not started yet",
+    registry=self_registry,
+)
+pool_active_tasks = Gauge(
+    "aliyun_exporter_pool_active_tasks",
+    "requests running in the fetch pool",
+    registry=self_registry,
+)
+series_dropped = Counter(
+    "aliyun_exporter_series_dropped",
+    "series dropped because the metric exceeded its series limit",
+    ["metric"],
+    registry=self_registry,
+)
+
+
+# 当前线程中 fetch_pool.map 分散提交累计等待的时长，各阶段、账号的采集耗时扣除这部分
+_pacing = threading.local()
+
+
+def paced_seconds():
+    """
+    :return: 当前线程累计的分散提交等待时长（单位：秒）
+    """
+    return getattr(_pacing, "seconds", 0.0)
+
+
+@contextlib.contextmanager
+def collect_phase(account: dict, phase: str):
+    """
+    记录单个账号本次采集中某个阶段的耗时，不含分散提交的等待
+    :param phase: inventory、fetch、build
+    """
+    started, paced = time.time(), paced_seconds()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - started - (paced_seconds() - paced)
+        collect_phase_duration.labels(*collect_key(account), phase).set(elapsed)
+
+
+def is_throttling(e: Exception):
+    """
+    :return: 是否为阿里云限流错误，如 Throttling、Throttling.User、Throttling.Api
+    """
+    return isinstance(e, ServerException) and str(e.error_code).startswith("Throttling")
+
+
+def is_retryable(e: Exception):
+    """
+    :return: 是否为可重试的错误：限流、服务端 5xx、网络错误
+    """
+    if is_throttling(e):
+        return True
+    if isinstance(e, ServerException):
+        return (e.http_status or 0) >= 500 or e.error_code in ("ServiceUnavailable", "InternalError")
+    if isinstance(e, ClientException):
+        return e.error_code in (error_code.SDK_HTTP_ERROR, error_code.SDK_SERVER_UNREACHABLE)
+    return False
+
+
+class token_bucket:
+    def __init__(self, rate: float):
+        """
+        :param rate: 每秒允许的请求数上限，同时也是桶容量
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = rate / 20
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        取一个令牌，没有令牌时等待
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def throttled(self):
+        """
+        被限流：速率减半并清空令牌
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+
+    def succeeded(self):
+        """
+        请求成功：速率逐步恢复到上限
+        """
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+
+class rate_limiter:
+    def __init__(
+        self,
+        qps: float = DEFAULT_QPS,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_delay: float = DEFAULT_RETRY_BASE_DELAY,
+        max_delay: float = DEFAULT_RETRY_MAX_DELAY,
+    ):
+        """
+        :param qps: 单个 (accessKeyId, action) 每秒请求数上限
+        :param max_retries: 可重试错误的最大重试次数
+        :param base_delay: 第一次重试的最大等待时间（单位：秒），之后每次翻倍
+        :param max_delay: 单次重试的最大等待时间（单位：秒）
+        """
+        self.qps = qps
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key_id: str, action: str):
+        with self._lock:
+            bucket = self._buckets.get((key_id, action))
+            if bucket is None:
+                bucket = self._buckets[(key_id, action)] = token_bucket(self.qps)
+            return bucket
+
+    def call(self, key_id: str, client, request, account: str = None):
+        """
+        限速后执行请求，可重试错误按带抖动的指数退避重试，重试耗尽或不可重试时抛出原异常
+        :param account: 账号名，用于自身运行状态 metrics 和日志，未传入时使用 key_id 的短别名
+        :return: 阿里云返回的原始数据
+        """
+        action = request.get_action_name()
+        account = account or key_alias(key_id)
+        key = request.get_query_params().get("Key", "")
+        # 批量请求的 Key 为逗号分隔的列表，组合随到期的监控项变化，不作为 label 取值
+        latency = api_request_duration.labels(action, "" if "," in key else key)
+        bucket = self.bucket(key_id, action)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            api_requests.labels(account, action).inc()
+            started = time.time()
+            try:
+                response = client.do_action_with_exception(request)
+            except (ServerException, ClientException) as e:
+                latency.observe(time.time() - started)
+                api_errors.labels(account, action, e.error_code).inc()
+                if is_throttling(e):
+                    api_throttles.labels(account, action).inc()
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                if is_throttling(e):
+                    bucket.throttled()
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                attempt += 1
+                logging.warning(f"{account} {action} 请求失败 {e.error_code}，{delay:.2f}s 后第 {attempt} 次重试")
+                time.sleep(delay)
+            else:
+                latency.observe(time.time() - started)
+                bucket.succeeded()
+                return response
+
+
+class limited_client:
+    """
+    AcsClient 包装，do_action_with_exception 经过 rate_limiter 限速与重试
+    """
+
+    def __init__(self, client, limiter: rate_limiter, key_id: str, account: str = None):
+        self.client = client
+        self.limiter = limiter
+        self.key_id = key_id
+        self.account = account
+
+    def do_action_with_exception(self, request):
+        return self.limiter.call(self.key_id, self.client, request, self.account)
+
+
+class client_registry:
+    def __init__(
+        self,
+        pool_size: int = DEFAULT_ACCOUNT_LIMIT,
+        idle_timeout: int = DEFAULT_CLIENT_IDLE_TIMEOUT,
+        limiter: rate_limiter = None,
+    ):
+        """
+        :param pool_size: 每个 client 的 http 连接池大小，应不小于单账号并发数
+        :param idle_timeout: client 空闲多久后关闭（单位：秒）
+        :param limiter: 所有 client 共用的限速器，未传入时使用默认配置新建
+        """
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.limiter = limiter or rate_limiter()
+        # {(accessKeyId, accessSecret, 区域): [limited_client, 最近使用时间]}
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, key_id: str, secret: str, region: str, account: str = None):
+        """
+        :param account: 账号名，用于自身运行状态 metrics
+        :return: 该账号、区域对应的常驻 client，重试由 rate_limiter 负责，关闭 sdk 自带的重试
+        """
+        key = (key_id, secret, region)
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is None:
+                client = AcsClient(
+                    ak=key_id, secret=secret, region_id=region, auto_retry=False, pool_size=self.pool_size
+                )
+                entry = self._clients[key] = [limited_client(client, self.limiter, key_id, account), now]
+            entry[1] = now
+            return entry[0]
+
+    def _evict_idle(self, now: float):
+        for key, (client, last_used) in list(self._clients.items()):
+            if now - last_used > self.idle_timeout:
+                del self._clients[key]
+                client.client.session.close()
+                # 日志中只出现账号名或 accessKeyId 的短别名
+                logging.info(f"client {client.account or key_alias(key[0])}/{key[2]} 空闲超过 {self.idle_timeout}s，已关闭")
+
+
+class fetch_pool:
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        account_limit: int = DEFAULT_ACCOUNT_LIMIT,
+        region_limit: int = DEFAULT_REGION_LIMIT,
+    ):
+        """
+        :param max_workers: 线程池总并发数
+        :param account_limit: 单个账号同时进行中的请求数上限
+        :param region_limit: 单个区域同时进行中的请求数上限
+        """
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="aliyun_fetch")
+        self.account_limit = account_limit
+        self.region_limit = region_limit
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, key, limit: int):
+        with self._lock:
+            semaphore = self._semaphores.get(key)
+            if semaphore is None:
+                semaphore = self._semaphores[key] = threading.BoundedSemaphore(limit)
+            return semaphore
+
+    def submit(self, account: dict, fn, *args, deadline: float = None, **kwargs):
+        """
+        在提交方线程中先占用账号、区域的并发名额，任务结束后释放，
+        避免工作线程因等待名额被占满
+        :param account: 请求所属的账号信息
+        :param deadline: 等待名额的截止时间（time.time()），超时抛出 TimeoutError
+        :return: Future
+        """
+        name, region = account_key(account)
+        # 固定先账号后区域的获取顺序
+        semaphores = (
+            self._semaphore(("account", name, region), self.account_limit),
+            self._semaphore(("region", region), self.region_limit),
+        )
+        acquired = []
+        try:
+            for semaphore in semaphores:
+                timeout = None if deadline is None else max(0, deadline - time.time())
+                if not semaphore.acquire(timeout=timeout):
+                    raise TimeoutError(f"账号 {(name, region)} 等待并发名额超时")
+                acquired.append(semaphore)
+            # 先计数再提交：工作线程可能在 submit 返回前就执行 _run 并减一
+            pool_queued_tasks.inc()
+            try:
+                future = self.executor.submit(self._run, fn, *args, **kwargs)
+            except Exception:
+                pool_queued_tasks.dec()
+                raise
+        except Exception:
+            for semaphore in acquired:
+                semaphore.release()
+            raise
+
+        def release(done):
+            # 未开始就被取消的任务不会经过 _run
+            if done.cancelled():
+                pool_queued_tasks.dec()
+            for semaphore in semaphores:
+                semaphore.release()
+
+        future.add_done_callback(release)
+        return future
+
+    @staticmethod
+    def _run(fn, *args, **kwargs):
+        pool_queued_tasks.dec()
+        pool_active_tasks.inc()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            pool_active_tasks.dec()
+
+    def map(self, account: dict, fn, args_list: list, deadline: float = None, spread: float = 0):
+        """
+        并发执行 fn(*args)，等待全部完成后按提交顺序返回结果，任一任务异常则抛出
+        :param args_list: [(参数, ...), ...]
+        :param deadline: 本账号采集的截止时间，超时后取消未开始的任务并抛出 TimeoutError
+        :param spread: 在多少秒内均匀提交（单位：秒），为 0 时一次性提交；
+                       最多占用到截止时间前剩余时间的一半，留出执行时间；
+                       等待时长记为 pace 阶段，不计入调用方的阶段耗时
+        :return: [结果, ...]
+        """
+        futures = []
+        paced = 0.0
+        started = time.time()
+        if deadline is not None:
+            spread = min(spread, max(0, (deadline - started) / 2))
+        step = spread / len(args_list) if args_list else 0
+        try:
+            for number, args in enumerate(args_list):
+                delay = started + number * step - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                    paced += delay
+                futures.append(self.submit(account, fn, *args, deadline=deadline))
+            timeout = None if deadline is None else max(0, deadline - time.time())
+            _, not_done = wait(futures, timeout=timeout)
+            if not_done:
+                raise TimeoutError(f"账号 {account_key(account)} 采集超时，{len(not_done)} 个请求未完成")
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            _pacing.seconds = paced_seconds() + paced
+            collect_phase_duration.labels(*collect_key(account), "pace").set(paced)
+        return [future.result() for future in futures]
+
+
+class metric_family:
+    def __init__(
+        self, name: str, documentation: str, labelnames, metric_type: str = "gauge", unit: str = "",
+        complete: bool = False,
+    ):
+        """
+        单个 metrics 的数据，label 取值、value、数据时间戳以平行数组保存
+        :param labelnames: label 名称列表，add 时按相同顺序传入取值
+        :param metric_type: gauge 或 counter
+        :param unit: 单位，如 bytes、seconds，输出到 openmetrics 的 UNIT 中
+        :param complete: 每个周期都完整输出（如由清单生成的状态、meta），不沿用上一次快照，
+                         状态变化后旧的 label 组合立即消失
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.metric_type = metric_type
+        self.unit = unit
+        self.complete = complete
+        self.labelvalues = []
+        self.values = []
+        # 阿里云返回的数据点时间（单位：秒），没有时为 None
+        self.timestamps = []
+        # 各 series 最近一次更新时间，seal 时统一填充
+        self.seen = []
+
+    def add(self, labelvalues: tuple, value, timestamp: float = None):
+        """
+        :param labelvalues: label 取值，顺序与 labelnames 一致，统一转为字符串
+        :param value: 数值，字符串会被转为 float
+        :param timestamp: 数据点的时间（单位：秒），输出到 /metrics 中
+        """
+        self.labelvalues.append(tuple(str(v) for v in labelvalues))
+        self.values.append(float(value))
+        self.timestamps.append(timestamp)
+
+
+class metrics_snapshot:
+    def __init__(self, stale_ttl: int = DEFAULT_STALE_TTL):
+        """
+        :param stale_ttl: series 未更新多久后过期（单位：秒）
+        """
+        self.stale_ttl = stale_ttl
+        # {metrics 名称: metric_family}
+        self.families = {}
+
+    def gauge(self, name: str, documentation: str, labelnames, complete: bool = False):
+        """
+        :param complete: 见 metric_family
+        :return: 名称对应的 metric_family，不存在时新建
+        """
+        return self.family(name, documentation, labelnames, complete=complete)
+
+    def family(
+        self, name: str, documentation: str, labelnames, metric_type: str = "gauge", unit: str = "",
+        complete: bool = False,
+    ):
+        """
+        :return: 名称对应的 metric_family，不存在时按指定类型、单位新建
+        """
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = metric_family(
+                name, documentation, labelnames, metric_type, unit, complete
+            )
+        return family
+
+    def seal(self, now: float):
+        """
+        采集完成后调用：同一 label 取值只保留最后一次写入，并记录更新时间
+        """
+        for family in self.families.values():
+            series = dict(zip(family.labelvalues, zip(family.values, family.timestamps)))
+            family.labelvalues = list(series.keys())
+            family.values = [value for value, _ in series.values()]
+            family.timestamps = [timestamp for _, timestamp in series.values()]
+            family.seen = [now] * len(family.values)
+
+    def carry_over(self, previous, now: float):
+        """
+        沿用上一次快照中本周期未采到（包括没有新数据点）、且未过期的 series
+        :param previous: 上一次的 metrics_snapshot，没有时为 None
+        """
+        if previous is None:
+            return
+        for name, old in previous.families.items():
+            # 本周期完整输出的 family 不沿用旧 series
+            if name in self.families and self.families[name].complete:
+                continue
+            family = self.family(name, old.documentation, old.labelnames, old.metric_type, old.unit)
+            # label 名称变化（升级、修改 cardinality_policy 配置）后旧 series 不再沿用
+            if family.labelnames != old.labelnames:
+                continue
+            present = set(family.labelvalues)
+            for labelvalues, value, timestamp, seen in zip(
+                old.labelvalues, old.values, old.timestamps, old.seen
+            ):
+                if labelvalues not in present and now - seen <= self.stale_ttl:
+                    family.labelvalues.append(labelvalues)
+                    family.values.append(value)
+                    family.timestamps.append(timestamp)
+                    family.seen.append(seen)
+
+
+class cardinality_policy:
+    def __init__(self, config: dict = None):
+        """
+        :param config: 配置内容，格式为
+            default:
+              max_series: 100000          # 单个账号快照中每个 metrics 的 series 上限
+            metrics:
+              aliyun_polarDB_meta:
+                deny: [CreateTime]        # 去掉的 label
+                max_series: 20000
+              aliyun_polarDB_performance:
+                allow: [cluster_id, node_id, performance_type]   # 只保留的 label
+        """
+        config = config or {}
+        self.default_max_series = int((config.get("default") or {}).get("max_series", DEFAULT_MAX_SERIES))
+        self.rules = config.get("metrics") or {}
+
+    def apply(self, snapshot: metrics_snapshot):
+        """
+        按配置去掉 label、限制 series 数，可以重复调用
+        """
+        for name, family in snapshot.families.items():
+            rule = self.rules.get(name) or {}
+            allow, deny = rule.get("allow"), rule.get("deny") or ()
+            keep = [
+                index for index, labelname in enumerate(family.labelnames)
+                if (allow is None or labelname in allow) and labelname not in deny
+            ]
+            if len(keep) < len(family.labelnames):
+                self._project(family, keep)
+            max_series = int(rule.get("max_series", self.default_max_series))
+            dropped = len(family.values) - max_series
+            if dropped > 0:
+                # 先写入的 series 优先保留，carry_over 沿用的旧 series 排在后面
+                del family.labelvalues[max_series:], family.values[max_series:]
+                del family.timestamps[max_series:], family.seen[max_series:]
+                series_dropped.labels(name).inc(dropped)
+                logging.warning(f"metrics {name} 超过 {max_series} 个 series，丢弃 {dropped} 个")
+
+    @staticmethod
+    def _project(family: metric_family, keep: list):
+        family.labelnames = tuple(family.labelnames[index] for index in keep)
+        series = {}
+        for labelvalues, value, timestamp, seen in zip(
+            family.labelvalues, family.values, family.timestamps, family.seen
+        ):
+            series[tuple(labelvalues[index] for index in keep)] = (value, timestamp, seen)
+        family.labelvalues = list(series.keys())
+        family.values = [value for value, _, _ in series.values()]
+        family.timestamps = [timestamp for _, timestamp, _ in series.values()]
+        family.seen = [seen for _, _, seen in series.values()]
+
+
+class mapped_metric:
+    __slots__ = (
+        "name", "documentation", "metric_type", "unit", "labelnames", "labelvalues", "value_format_label", "transform"
+    )
+
+    def __init__(self, entry: dict, base_labelnames: tuple):
+        """
+        metric_mapping 中编译后的单个条目
+        :param entry: yaml 中的单个条目
+        :param base_labelnames: 产品固定输出的 label，如 account、db_instance_id
+        """
+        self.metric_type = entry.get("type", "gauge")
+        if self.metric_type not in ("gauge", "counter"):
+            raise ValueError(f"监控项 {entry['key']} 的类型 {self.metric_type} 不支持，可选 gauge、counter")
+        self.unit = entry.get("unit", "")
+        # 与 prometheus_client 一致，名称不以单位结尾时自动追加
+        name = entry["name"]
+        if self.unit and not name.endswith("_" + self.unit):
+            name += "_" + self.unit
+        self.name = name
+        self.documentation = entry.get("help", f"aliyun {entry['key']}")
+        self.value_format_label = entry.get("value_format_label")
+        # 跨周期计算方式：integrate 累加为 counter，rate 计算每秒增量
+        self.transform = entry.get("transform")
+        if self.transform == "integrate":
+            self.metric_type = "counter"
+        elif self.transform == "rate":
+            self.metric_type = "gauge"
+        elif self.transform is not None:
+            raise ValueError(f"监控项 {entry['key']} 的 transform {self.transform} 不支持，可选 integrate、rate")
+        labels = entry.get("labels") or {}
+        extra = ((self.value_format_label,) if self.value_format_label else ()) + tuple(labels)
+        self.labelnames = tuple(base_labelnames) + extra
+        self.labelvalues = tuple(str(value) for value in labels.values())
+
+    def add(
+        self, snapshot, base_labelvalues: tuple, value_format: str, value, timestamp: float = None, counters=None,
+        earlier: tuple = (),
+    ):
+        """
+        将单个取值写入快照
+        :param base_labelvalues: 与 base_labelnames 对应的取值
+        :param value_format: 该取值对应的 ValueFormat
+        :param counters: counter_store，配置了 transform 时必须传入
+        :param earlier: 同一查询窗口内更早的数据点 ((取值, 数据点时间), ...)，integrate 时先逐点累加，
+            已累加过的数据点由 counter_store 按时间跳过；rate 只使用最新数据点
+        """
+        if self.value_format_label:
+            labelvalues = base_labelvalues + (value_format,) + self.labelvalues
+        else:
+            labelvalues = base_labelvalues + self.labelvalues
+        if self.transform is not None:
+            if counters is None:
+                raise ValueError(f"metrics {self.name} 配置了 transform {self.transform}，需要传入 counter_store")
+            if self.transform == "integrate":
+                for one_value, one_timestamp in earlier:
+                    counters.integrate((self.name, labelvalues), one_value, one_timestamp)
+                value = counters.integrate((self.name, labelvalues), float(value), timestamp)
+            else:
+                value = counters.rate((self.name, labelvalues), float(value), timestamp)
+                # 第一个数据点、或与上一个数据点间隔过长时没有增量
+                if value is None:
+                    return
+        family = snapshot.family(self.name, self.documentation, self.labelnames, self.metric_type, self.unit)
+        family.add(labelvalues, value, timestamp)
+
+
+class metric_mapping:
+    def __init__(self, entries: list, base_labelnames: tuple):
+        """
+        :param entries: yaml 中 metrics 字段下的条目列表，每个条目包含
+            key：阿里云监控项，如 MongoDB_Opcounters
+            value_format：可选，只匹配该 ValueFormat，未指定时匹配全部
+            name：metrics 名称；type：gauge/counter，默认 gauge；unit：可选单位；help：可选说明
+            value_format_label：可选，ValueFormat 写入的 label 名称
+            labels：可选，固定的额外 label
+        :param base_labelnames: 产品固定输出的 label
+        """
+        # {(Key, ValueFormat 或 None): mapped_metric}
+        self._table = {}
+        self.keys = []
+        # 含有 transform 为 integrate 条目的 Key，需要查询窗口内的全部数据点
+        self.integrated_keys = set()
+        for entry in entries:
+            key = entry["key"]
+            if key not in self.keys:
+                self.keys.append(key)
+            target = self._table[(key, entry.get("value_format"))] = mapped_metric(entry, base_labelnames)
+            if target.transform == "integrate":
+                self.integrated_keys.add(key)
+
+    def lookup(self, key: str, value_format: str):
+        """
+        :return: (Key, ValueFormat) 对应的 mapped_metric，没有精确匹配时使用该 Key 的通配条目，都没有时为 None
+        """
+        target = self._table.get((key, value_format))
+        if target is None:
+            target = self._table.get((key, None))
+        return target
+
+    def add(
+        self, snapshot, base_labelvalues: tuple, key: str, value_format: str, values: tuple, timestamp: float = None,
+        counters=None, earlier: tuple = (),
+    ):
+        """
+        将单个监控项的数据点写入快照，多个 ValueFormat 时以 & 分隔，一次写入全部取值
+        :param value_format: 阿里云返回的 ValueFormat，如 insert&query&update
+        :param values: 与 ValueFormat 一一对应的取值，如 (0.1, 2.3, 0.0)，空取值为 None，见 parse_values
+        :param counters: counter_store，保存 transform 条目的跨周期状态
+        :param earlier: 同一查询窗口内更早的数据点 ((取值元组, 数据点时间), ...)，见 performance_point
+        :return: 写入的取值个数
+        """
+        count = 0
+        for index, (one_format, one_value) in enumerate(zip(value_format.split("&"), values)):
+            target = self.lookup(key, one_format)
+            if target is None or one_value is None:
+                continue
+            one_earlier = ()
+            if earlier and target.transform == "integrate":
+                one_earlier = tuple(
+                    (point[index], point_time) for point, point_time in earlier
+                    if index < len(point) and point[index] is not None
+                )
+            target.add(snapshot, base_labelvalues, one_format, one_value, timestamp, counters, one_earlier)
+            count += 1
+        return count
+
+
+def parse_values(value: str):
+    """
+    解析 MongoDB 以 & 分隔的 Value
+    :param value: 阿里云返回的 Value，如 0.1&2.3&0
+    :return: (0.1, 2.3, 0.0)，空取值为 None
+    :raise ValueError, TypeError: 取值不是数字，如 N/A、null
+    """
+    return tuple(float(one) if one else None for one in value.split("&"))
+
+
+_mappings = {}
+_mappings_lock = threading.Lock()
+
+
+def load_metric_mapping(path: str, base_labelnames: tuple):
+    """
+    读取并编译 yaml 中的监控项对应关系，同一文件只编译一次
+    :param path: yaml 文件路径，监控项列表位于 metrics 字段下
+    :param base_labelnames: 产品固定输出的 label
+    :return: metric_mapping
+    """
+    with _mappings_lock:
+        mapping = _mappings.get((path, base_labelnames))
+        if mapping is None:
+            with open(path) as file:
+                content = yaml.safe_load(file)
+            mapping = metric_mapping(content.get("metrics") or [], base_labelnames)
+            _mappings[(path, base_labelnames)] = mapping
+        return mapping
+
+
+class watermark_store:
+    def __init__(self, max_lookback: int = DEFAULT_MAX_LOOKBACK, ttl: int = DEFAULT_WATERMARK_TTL):
+        """
+        记录每个节点/实例各监控项已取到的最新数据点时间，下次只查询之后的数据
+        :param max_lookback: 查询窗口最多向前回溯多久（单位：秒）
+        :param ttl: 节点/实例多久没有新数据后删除其记录（单位：秒）
+        """
+        self.max_lookback = max_lookback
+        self.ttl = ttl
+        # {(账号名, 区域, 节点/实例 id): [{监控项: 最新数据点时间}, 最近更新时间]}
+        self._marks = {}
+        self._pruned = time.time()
+        self._lock = threading.Lock()
+
+    def start_time(self, scope: tuple, default_lookback: int, horizon: float = None):
+        """
+        :param scope: (账号名, 区域, 节点/实例 id)
+        :param default_lookback: 没有记录时向前查询多久（单位：秒）
+        :param horizon: 只考虑最近 horizon 秒内的记录，本次不查询的慢监控项的旧记录不会拉长查询窗口
+        :return: 本次查询窗口的开始时间（单位：秒）
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._marks.get(scope)
+            marks = entry[0].values() if entry else ()
+            if horizon is not None:
+                marks = [mark for mark in marks if mark >= now - horizon]
+            if not marks:
+                return now - default_lookback
+            return max(min(marks), now - self.max_lookback)
+
+    def advance(self, scope: tuple, name: str, timestamp: float):
+        """
+        :return: timestamp 比已记录的更新时返回 True 并记录，否则返回 False
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._marks.get(scope)
+            if entry is None:
+                entry = self._marks[scope] = [{}, now]
+            if timestamp <= entry[0].get(name, 0):
+                return False
+            entry[0][name] = timestamp
+            entry[1] = now
+            if now - self._pruned > self.ttl / 10:
+                self._prune(now)
+            return True
+
+    def _prune(self, now: float):
+        for scope, (_, updated) in list(self._marks.items()):
+            if now - updated > self.ttl:
+                del self._marks[scope]
+        self._pruned = now
+
+    def state(self):
+        """
+        :return: 可以 marshal 的记录副本，用于 snapshot_store
+        """
+        with self._lock:
+            return {scope: (dict(marks), updated) for scope, (marks, updated) in self._marks.items()}
+
+    def restore(self, state: dict):
+        """
+        :param state: state() 的返回值
+        """
+        with self._lock:
+            for scope, (marks, updated) in state.items():
+                self._marks.setdefault(scope, [dict(marks), updated])
+
+
+class refresh_schedule:
+    def __init__(self, hot_hold: int = DEFAULT_HOT_HOLD, ttl: int = DEFAULT_WATERMARK_TTL):
+        """
+        记录各节点/实例每个监控项的下次到期时间，以及热点节点/实例
+        :param hot_hold: 超过阈值后保持热点多久（单位：秒）
+        :param ttl: 节点/实例多久没有查询后删除其记录（单位：秒）
+        """
+        self.hot_hold = hot_hold
+        self.ttl = ttl
+        # {(账号名, 区域, 节点/实例 id): [{监控项: 下次到期时间}, 最近查询时间]}
+        self._due = {}
+        # {(账号名, 区域, 节点/实例 id): 保持热点到的时间}
+        self._hot = {}
+        self._pruned = time.time()
+        self._lock = threading.Lock()
+
+    def is_hot(self, scope: tuple, now: float = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._hot.get(scope, 0) > now
+
+    def heat(self, scope: tuple, now: float = None):
+        """
+        标记为热点，保持 hot_hold 秒
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._hot[scope] = now + self.hot_hold
+
+    @staticmethod
+    def intervals(keys, key_intervals: dict, cold_interval: int = None):
+        """
+        :param keys: 全部监控项
+        :param key_intervals: 插件单独配置的刷新间隔
+        :param cold_interval: 其余监控项在非热点节点/实例上的刷新间隔，为 None 时每个周期都查询
+        :return: {监控项: 刷新间隔（单位：秒）}，用于 due_keys、fetched
+        """
+        if not cold_interval:
+            return dict(key_intervals)
+        return {key: key_intervals.get(key, cold_interval) for key in keys}
+
+    def due_keys(self, scope: tuple, keys, intervals: dict, slack: float = 0):
+        """
+        :param keys: 全部监控项
+        :param intervals: {监控项: 刷新间隔（单位：秒）}，未配置的监控项每次都到期
+        :param slack: 提前量（单位：秒），在下一个采集周期之前到期的监控项本次就查询
+        :return: 本次需要查询的监控项，热点返回全部监控项
+        """
+        now = time.time()
+        with self._lock:
+            if self._hot.get(scope, 0) > now:
+                return list(keys)
+            entry = self._due.get(scope)
+            due = entry[0] if entry else {}
+            return [key for key in keys if not intervals.get(key) or due.get(key, 0) <= now + slack]
+
+    def fetched(self, scope: tuple, keys, intervals: dict):
+        """
+        记录本次已查询成功的监控项，计算下次到期时间
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._due.get(scope)
+            if entry is None:
+                entry = self._due[scope] = [{}, now]
+            for key in keys:
+                interval = intervals.get(key)
+                if not interval:
+                    continue
+                if key in entry[0]:
+                    # 按原来的相位推进，不以本次查询时间为起点，错开的分布不会被采集周期的边界抹平；
+                    # 热点提前查询时，尚未临近的到期时间保持不变
+                    due = entry[0][key]
+                    while due <= now + interval / 2:
+                        due += interval
+                    entry[0][key] = due
+                else:
+                    # 第一次查询后按节点/实例的哈希错开，之后固定间隔，各节点/实例均匀分布在整个间隔内；
+                    # 同一节点/实例的监控项使用相同的哈希，间隔成倍数时到期时间对齐，批量模式下合并为一次请求
+                    entry[0][key] = now + _ring_hash("/".join(scope)) % interval
+            entry[1] = now
+            if now - self._pruned > self.ttl / 10:
+                self._prune(now)
+
+    def order(self, scopes: list):
+        """
+        :param scopes: [(账号名, 区域, 节点/实例 id), ...]
+        :return: 热点排在前面的下标列表，其余保持原顺序
+        """
+        now = time.time()
+        with self._lock:
+            return sorted(range(len(scopes)), key=lambda index: self._hot.get(scopes[index], 0) <= now)
+
+    def _prune(self, now: float):
+        for scope, (_, updated) in list(self._due.items()):
+            if now - updated > self.ttl:
+                del self._due[scope]
+        for scope, until in list(self._hot.items()):
+            if until <= now:
+                del self._hot[scope]
+        self._pruned = now
+
+
+class counter_store:
+    def __init__(self, ttl: int = DEFAULT_COUNTER_TTL, max_gap: int = DEFAULT_MAX_LOOKBACK):
+        """
+        保存 transform 监控项每个 series 的上一个数据点，跨采集周期计算累计值、每秒增量
+        :param ttl: series 多久没有新数据点后删除其状态（单位：秒）
+        :param max_gap: 相邻数据点间隔超过该值时不计算，只作为新的起点（单位：秒）
+        """
+        self.ttl = ttl
+        self.max_gap = max_gap
+        # {(metrics 名称, label 取值): [上一个数据点的值, 上一个数据点时间, 累计值, 最近更新时间]}
+        self._series = {}
+        self._pruned = time.time()
+        self._lock = threading.Lock()
+
+    def _update(self, series: tuple, value: float, timestamp: float):
+        """
+        :return: (上一个数据点的值, 两个数据点的间隔, 该 series 的状态)，没有可用的上一个数据点时前两项为 None
+        """
+        now = time.time()
+        timestamp = now if timestamp is None else timestamp
+        entry = self._series.get(series)
+        if entry is None:
+            entry = self._series[series] = [value, timestamp, 0.0, now]
+            previous, elapsed = None, None
+        else:
+            previous, elapsed = entry[0], timestamp - entry[1]
+            if elapsed <= 0:
+                return None, None, entry
+            if elapsed > self.max_gap:
+                previous, elapsed = None, None
+            entry[0], entry[1] = value, timestamp
+        entry[3] = now
+        if now - self._pruned > self.ttl / 10:
+            self._prune(now)
+        return previous, elapsed, entry
+
+    def integrate(self, series: tuple, value: float, timestamp: float = None):
+        """
+        :param series: (metrics 名称, label 取值)
+        :param value: 每秒平均值
+        :param timestamp: 数据点时间（单位：秒）
+        :return: 累计值，第一个数据点为 0
+        """
+        with self._lock:
+            previous, elapsed, entry = self._update(series, value, timestamp)
+            if elapsed is not None:
+                entry[2] += value * elapsed
+            return entry[2]
+
+    def rate(self, series: tuple, value: float, timestamp: float = None):
+        """
+        :param series: (metrics 名称, label 取值)
+        :param value: 累计值
+        :param timestamp: 数据点时间（单位：秒）
+        :return: 与上一个数据点之间的每秒增量，没有可用的上一个数据点时为 None
+        """
+        with self._lock:
+            previous, elapsed, _ = self._update(series, value, timestamp)
+        if elapsed is None:
+            return None
+        delta = value - previous
+        # 取值变小说明计数器被重置（如实例重启），重置后从 0 开始计数
+        if delta < 0:
+            delta = value
+        return delta / elapsed
+
+    def _prune(self, now: float):
+        for series, entry in list(self._series.items()):
+            if now - entry[3] > self.ttl:
+                del self._series[series]
+        self._pruned = now
+
+    def state(self):
+        """
+        :return: 可以 marshal 的状态副本，用于 snapshot_store
+        """
+        with self._lock:
+            return {series: tuple(entry) for series, entry in self._series.items()}
+
+    def restore(self, state: dict):
+        """
+        :param state: state() 的返回值
+        """
+        with self._lock:
+            for series, entry in state.items():
+                self._series.setdefault(series, list(entry))
+
+
+def aliyun_time(timestamp: float):
+    """
+    :return: 阿里云性能接口使用的时间格式 yyyy-MM-ddTHH:mmZ（UTC时间）
+    """
+    return time.strftime("%Y-%m-%dT%H:%MZ", time.gmtime(timestamp))
+
+
+class snapshot_collector:
+    """
+    prometheus 自定义 Collector，/metrics 时直接由各账号的快照生成 GaugeMetricFamily，
+    同名 metrics 合并到同一个 family 下，避免重复的 HELP/TYPE
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    def collect(self):
+        families = snapshot_families(self.scheduler.snapshots().values(), time.time())
+        up = GaugeMetricFamily(
+            "aliyun_exporter_account_up",
+            "whether the last collection of the account succeeded",
+            labels=["product", "account", "region"],
+        )
+        duration = GaugeMetricFamily(
+            "aliyun_exporter_account_collect_duration_seconds",
+            "duration of the last collection of the account",
+            labels=["product", "account", "region"],
+        )
+        for key, (account_up, seconds) in self.scheduler.status().items():
+            up.add_metric(key, account_up)
+            duration.add_metric(key, seconds)
+        families[up.name] = up
+        families[duration.name] = duration
+        return families.values()
+
+
+def snapshot_families(snapshots, now: float, with_timestamps: bool = True):
+    """
+    将多个账号的快照合并为 GaugeMetricFamily/CounterMetricFamily，同名 metrics 合并到同一个 family 下，
+    过期的 series 不输出
+    :param snapshots: [(metrics_snapshot, 采集完成时间), ...]
+    :param with_timestamps: 是否输出数据点时间戳，Pushgateway 不接受带时间戳的数据
+    :return: {metrics 名称: GaugeMetricFamily}
+    """
+    families = {}
+    for snapshot, _ in snapshots:
+        for name, family in snapshot.families.items():
+            metric = families.get(name)
+            if metric is None:
+                family_class = CounterMetricFamily if family.metric_type == "counter" else GaugeMetricFamily
+                metric = families[name] = family_class(
+                    name, family.documentation, labels=family.labelnames, unit=family.unit
+                )
+            for labelvalues, value, timestamp, seen in zip(
+                family.labelvalues, family.values, family.timestamps, family.seen
+            ):
+                if now - seen <= snapshot.stale_ttl:
+                    # CounterMetricFamily 的第三个参数为 created，时间戳需按名称传入
+                    metric.add_metric(labelvalues, value, timestamp=timestamp if with_timestamps else None)
+    return families
+
+
+class snapshot_state_collector:
+    """
+    各账号快照的采集完成时间、是否从文件恢复，只在采集完成时变化，与快照一起预渲染
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    def collect(self):
+        timestamp = GaugeMetricFamily(
+            "aliyun_exporter_snapshot_timestamp_seconds",
+            "unix time of the last successful collection of the account",
+            labels=["product", "account", "region"],
+        )
+        restored = GaugeMetricFamily(
+            "aliyun_exporter_snapshot_restored",
+            "whether the snapshot of the account was restored from disk and not yet refreshed",
+            labels=["product", "account", "region"],
+        )
+        restored_keys = self.scheduler.restored()
+        for key, (_, finished) in self.scheduler.snapshots().items():
+            timestamp.add_metric(key, finished)
+            restored.add_metric(key, 1 if key in restored_keys else 0)
+        return [timestamp, restored]
+
+
+class exposition_cache:
+    def __init__(self, registry, render_interval: float = DEFAULT_RENDER_INTERVAL):
+        """
+        :param registry: 快照、快照时间与自身运行状态的 registry，有账号更新后由 render_loop 预渲染
+        :param render_interval: 两次预渲染之间的最小间隔（单位：秒）
+        """
+        self.registry = registry
+        self.render_interval = render_interval
+        self._dirty = threading.Event()
+        self._refreshed = 0
+        # {是否 openmetrics 格式: (文本, gzip 压缩后的文本, ETag)}，整体替换，读取时不加锁
+        self._rendered = {}
+        self._lock = threading.Lock()
+
+    def _render(self, openmetrics: bool):
+        body = openmetrics_latest(self.registry) if openmetrics else generate_latest(self.registry)
+        etag = 'W/"%s-%s"' % ("om" if openmetrics else "text", hashlib.md5(body).hexdigest())
+        return body, gzip.compress(body, compresslevel=6), etag
+
+    def refresh(self):
+        """
+        立即重新渲染 text 格式；openmetrics 格式在首次请求时渲染
+        """
+        started = time.time()
+        with self._lock:
+            self._rendered = {False: self._render(False)}
+        self._refreshed = time.time()
+        render_duration.set(self._refreshed - started)
+
+    def invalidate(self):
+        """
+        快照有变化时调用，由 render_loop 合并渲染
+        """
+        self._dirty.set()
+
+    def render_loop(self, stop: threading.Event):
+        """
+        后台渲染线程：有变化时渲染，距上一次渲染不足 render_interval 秒时先等待，
+        等待期间完成的账号合并到同一次渲染，账号数再多每个间隔也最多渲染一次
+        :param stop: 设置后退出
+        """
+        while not stop.is_set():
+            if not self._dirty.wait(1):
+                continue
+            if stop.wait(max(0, self._refreshed + self.render_interval - time.time())):
+                return
+            self._dirty.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.exception(f"/metrics 预渲染失败： {e}")
+
+    def get(self, openmetrics: bool):
+        """
+        :return: (预渲染的文本, gzip 压缩后的文本, ETag)，三者来自同一次渲染
+        """
+        rendered = self._rendered.get(openmetrics)
+        if rendered is None:
+            with self._lock:
+                rendered = self._rendered.get(openmetrics)
+                if rendered is None:
+                    rendered = self._rendered[openmetrics] = self._render(openmetrics)
+        return rendered
+
+    def response(self, accept: str = "", use_gzip: bool = False, if_none_match: str = ""):
+        """
+        :param accept: 请求头 Accept，包含 application/openmetrics-text 时输出 openmetrics 格式
+        :param use_gzip: 客户端是否接受 gzip
+        :param if_none_match: 请求头 If-None-Match，与预渲染内容的 etag 一致时返回 304
+        :return: (状态码, 响应头, [响应内容分段])，预渲染的内容直接返回，不做拷贝
+        """
+        openmetrics = "application/openmetrics-text" in (accept or "")
+        headers = {
+            "Content-Type": OPENMETRICS_CONTENT_TYPE if openmetrics else CONTENT_TYPE_LATEST,
+            "Vary": "Accept, Accept-Encoding",
+        }
+        body, body_gzip, headers["ETag"] = self.get(openmetrics)
+        if if_none_match and headers["ETag"] in if_none_match:
+            return 304, headers, []
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+            body = body_gzip
+        headers["Content-Length"] = str(len(body))
+        return 200, headers, [body]
+
+
+def metrics_response(exposition, request):
+    """
+    flask /metrics 响应
+    :param exposition: exposition_cache 实例
+    :param request: flask request
+    """
+    status, headers, chunks = exposition.response(
+        request.headers.get("Accept", ""),
+        request.accept_encodings["gzip"] > 0,
+        request.headers.get("If-None-Match", ""),
+    )
+    return Response(chunks, status=status, headers=headers, direct_passthrough=True)
+
+
+def _ring_hash(value: str):
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class shard_filter:
+    def __init__(self, shard_index: int = 0, shard_count: int = 1, vnodes: int = DEFAULT_SHARD_VNODES):
+        """
+        一致性哈希环，每个副本在环上占 vnodes 个虚拟节点
+        :param shard_index: 本副本序号，从 0 开始
+        :param shard_count: 副本总数，为 1 时不分片
+        :param vnodes: 每个副本的虚拟节点数，越大分配越均匀
+        """
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f"shard_index 需要在 [0, {shard_count}) 范围内： {shard_index}")
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        ring = sorted(
+            (_ring_hash(f"shard-{index}-{vnode}"), index)
+            for index in range(shard_count)
+            for vnode in range(vnodes)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [index for _, index in ring]
+
+    def owner(self, account: str, resource_id: str):
+        """
+        :return: (账号, 集群/实例 id) 所属的副本序号
+        """
+        if self.shard_count == 1:
+            return 0
+        position = bisect.bisect(self._points, _ring_hash(f"{account}/{resource_id}"))
+        return self._owners[position % len(self._points)]
+
+    def owns(self, account: str, resource_id: str):
+        """
+        :return: 本副本是否负责采集该集群/实例
+        """
+        return self.owner(account, resource_id) == self.shard_index
+
+    def labels(self):
+        """
+        :return: 分片时区分副本的 label，不分片时为空
+        """
+        if self.shard_count == 1:
+            return {}
+        return {"shard": str(self.shard_index)}
+
+
+def shard_arguments(parser):
+    """
+    为命令行参数添加分片相关的参数
+    :param parser: argparse.ArgumentParser
+    """
+    group = parser.add_argument_group("shard")
+    group.add_argument("--shard-index", type=int, default=0, help="本副本序号，从 0 开始")
+    group.add_argument("--shard-count", type=int, default=1, help="副本总数，为 1 时不分片")
+
+
+def build_shard(args):
+    """
+    :param args: 包含 shard_arguments 参数的命令行参数
+    :return: shard_filter
+    """
+    return shard_filter(args.shard_index, args.shard_count)
+
+
+def _varint(value: int):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field(number: int, payload: bytes):
+    """
+    protobuf length-delimited 字段
+    """
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def encode_write_request(series: list):
+    """
+    按 prometheus remote write 的 WriteRequest 格式编码
+    :param series: [(((label 名称, label 取值), ...), value, 时间戳（毫秒）), ...]，label 需按名称排序
+    :return: protobuf 编码后的数据
+    """
+    body = bytearray()
+    for labels, value, timestamp in series:
+        timeseries = bytearray()
+        for name, label_value in labels:
+            timeseries += _field(1, _field(1, name.encode()) + _field(2, label_value.encode()))
+        # Sample：value 为 double（fixed64），timestamp 为 int64（varint）
+        sample = b"\x09" + struct.pack("<d", value) + b"\x10" + _varint(timestamp & 0xFFFFFFFFFFFFFFFF)
+        timeseries += _field(2, sample)
+        body += _field(1, bytes(timeseries))
+    return bytes(body)
+
+
+def snappy_compress(data: bytes):
+    """
+    snappy block 格式压缩，未安装 python-snappy 时全部以 literal 输出（合法的 snappy 数据，但不压缩）
+    """
+    if snappy is not None:
+        return snappy.compress(data)
+    out = bytearray(_varint(len(data)))
+    for offset in range(0, len(data), 65536):
+        chunk = data[offset:offset + 65536]
+        length = len(chunk) - 1
+        if length < 60:
+            out.append(length << 2)
+        elif length < 256:
+            out += bytes((60 << 2, length))
+        else:
+            out += bytes((61 << 2,)) + struct.pack("<H", length)
+        out += chunk
+    return bytes(out)
+
+
+def _is_retryable_http(e: Exception):
+    """
+    :return: 推送失败是否可重试：网络错误、429、5xx
+    """
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code == 429 or e.code >= 500
+    return isinstance(e, (urllib.error.URLError, OSError))
+
+
+class push_queue:
+    def __init__(
+        self,
+        max_in_flight: int = DEFAULT_PUSH_MAX_IN_FLIGHT,
+        max_pending: int = DEFAULT_PUSH_QUEUE_SIZE,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_delay: float = DEFAULT_RETRY_BASE_DELAY,
+        max_delay: float = DEFAULT_RETRY_MAX_DELAY,
+        timeout: float = DEFAULT_PUSH_TIMEOUT,
+    ):
+        """
+        推送请求的有界队列，所有推送方式共用，限制同时进行的请求数
+        :param max_in_flight: 发送线程数，即同时进行的推送请求上限
+        :param max_pending: 等待发送的请求上限，超出时丢弃最早的请求
+        :param max_retries: 可重试错误的最大重试次数
+        :param base_delay: 第一次重试的最大等待时间（单位：秒），之后每次翻倍
+        :param max_delay: 单次重试的最大等待时间（单位：秒）
+        :param timeout: 单次请求超时时间（单位：秒）
+        """
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._pending = deque(maxlen=max_pending)
+        self._ready = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        for number in range(self.max_in_flight):
+            thread = threading.Thread(target=self._run, name=f"push_{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, url: str, data: bytes, headers: dict, method: str = "POST"):
+        """
+        加入一个推送请求，不阻塞采集线程
+        """
+        with self._ready:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+                logging.warning(f"推送队列已满，丢弃最早的请求 {self._pending[0][0]}")
+            self._pending.append((url, data, headers, method))
+            self._ready.notify()
+
+    def pending(self):
+        with self._ready:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._ready:
+                while not self._pending:
+                    self._ready.wait()
+                url, data, headers, method = self._pending.popleft()
+            self.send(url, data, headers, method)
+
+    def send(self, url: str, data: bytes, headers: dict, method: str = "POST"):
+        """
+        发送单个请求，可重试错误按带抖动的指数退避重试
+        :return: 是否发送成功
+        """
+        attempt = 0
+        while True:
+            request = urllib.request.Request(url, data=data, headers=headers, method=method)
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    response.read()
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable_http(e):
+                    self.failed += 1
+                    logging.error(f"推送 {url} 失败： {e}")
+                    return False
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                attempt += 1
+                logging.warning(f"推送 {url} 失败 {e}，{delay:.2f}s 后第 {attempt} 次重试")
+                time.sleep(delay)
+            else:
+                self.sent += 1
+                return True
+
+
+class remote_writer:
+    def __init__(
+        self,
+        url: str,
+        queue: push_queue,
+        job: str,
+        batch_size: int = DEFAULT_PUSH_BATCH_SIZE,
+        shard: shard_filter = None,
+    ):
+        """
+        :param url: remote write 地址，如 http://prometheus:9090/api/v1/write
+        :param queue: 共用的推送队列
+        :param job: 写入每个 series 的 job label
+        :param batch_size: 单个请求最多包含的 series 数
+        :param shard: 分片时 account_up 带上副本序号
+        """
+        self.url = url
+        self.queue = queue
+        self.job = job
+        self.batch_size = batch_size
+        self.shard_labels = shard.labels() if shard else {}
+        self.headers = {
+            "Content-Type": "application/x-protobuf",
+            "Content-Encoding": "snappy",
+            "User-Agent": "aliyun-exporter",
+            "X-Prometheus-Remote-Write-Version": "0.1.0",
+        }
+
+    def push(self, key: tuple, snapshot, finished: float):
+        """
+        推送单个账号本周期更新的 series，沿用上一次的 series 已经推送过，不再重复发送
+        :param key: (产品, 账号名, 区域)
+        :param snapshot: 本周期的 metrics_snapshot，采集失败时为 None，只推送 up
+        :param finished: 采集完成时间
+        """
+        finished_ms = int(finished * 1000)
+        series = []
+        if snapshot is not None:
+            for name, family in snapshot.families.items():
+                # 与 /metrics、Pushgateway 的输出保持一致，counter 的 series 名称带 _total 后缀
+                if family.metric_type == "counter" and not name.endswith("_total"):
+                    name += "_total"
+                for labelvalues, value, timestamp, seen in zip(
+                    family.labelvalues, family.values, family.timestamps, family.seen
+                ):
+                    if seen != finished:
+                        continue
+                    labels = [("__name__", name), ("job", self.job)]
+                    labels.extend(zip(family.labelnames, labelvalues))
+                    labels.sort()
+                    series.append((
+                        tuple(labels), value, finished_ms if timestamp is None else int(timestamp * 1000)
+                    ))
+        up_labels = [
+            ("__name__", "aliyun_exporter_account_up"), ("job", self.job),
+            ("product", key[0]), ("account", key[1]), ("region", key[2]),
+        ]
+        up_labels.extend(self.shard_labels.items())
+        up_labels.sort()
+        series.append((tuple(up_labels), 0.0 if snapshot is None else 1.0, finished_ms))
+
+        for offset in range(0, len(series), self.batch_size):
+            body = encode_write_request(series[offset:offset + self.batch_size])
+            self.queue.put(self.url, snappy_compress(body), self.headers)
+
+
+class static_collector:
+    """
+    输出固定的 metrics family，用于渲染单个账号的推送内容
+    """
+
+    def __init__(self, families):
+        self.families = list(families)
+
+    def collect(self):
+        return self.families
+
+
+class pushgateway_pusher:
+    def __init__(self, url: str, queue: push_queue, job: str, shard: shard_filter = None):
+        """
+        :param url: Pushgateway 地址，如 http://pushgateway:9091
+        :param queue: 共用的推送队列
+        :param job: 分组使用的 job 名称
+        :param shard: 分片时按副本分组，各副本的数据互不覆盖
+        """
+        self.url = url.rstrip("/")
+        self.queue = queue
+        self.job = job
+        self.shard_labels = shard.labels() if shard else {}
+        self.headers = {"Content-Type": CONTENT_TYPE_LATEST}
+
+    def group_url(self, key: tuple):
+        """
+        按 (产品, 账号, 区域) 分组，label 名称避免与 metrics 自身的 label 冲突
+        """
+        quote = lambda value: urllib.parse.quote(str(value), safe="")
+        url = (
+            f"{self.url}/metrics/job/{quote(self.job)}/aliyun_product/{quote(key[0] or self.job)}"
+            f"/aliyun_account/{quote(key[1])}/aliyun_region/{quote(key[2])}"
+        )
+        for name, value in self.shard_labels.items():
+            url += f"/{name}/{quote(value)}"
+        return url
+
+    def push(self, key: tuple, snapshot, finished: float):
+        """
+        采集成功时 PUT 整组替换，已删除的 series 随之消失；失败时 POST 只更新 up，保留上一次的数据
+        :param key: (产品, 账号名, 区域)
+        :param snapshot: 本周期的 metrics_snapshot，采集失败时为 None
+        :param finished: 采集完成时间
+        """
+        families = {}
+        if snapshot is not None:
+            families = snapshot_families([(snapshot, finished)], finished, with_timestamps=False)
+        up = GaugeMetricFamily(
+            "aliyun_exporter_account_up",
+            "whether the last collection of the account succeeded",
+            labels=["product", "account", "region"],
+        )
+        up.add_metric(list(key), 0 if snapshot is None else 1)
+        families[up.name] = up
+
+        registry = CollectorRegistry(auto_describe=False)
+        registry.register(static_collector(families.values()))
+        method = "POST" if snapshot is None else "PUT"
+        self.queue.put(self.group_url(key), generate_latest(registry), self.headers, method)
+
+
+def push_arguments(parser):
+    """
+    为命令行参数添加推送模式相关的参数
+    :param parser: argparse.ArgumentParser
+    """
+    group = parser.add_argument_group("push")
+    group.add_argument("--remote-write-url", help="prometheus remote write 地址，每个账号采集完成后推送")
+    group.add_argument("--pushgateway-url", help="Pushgateway 地址，每个账号采集完成后推送")
+    group.add_argument("--push-job", help="推送时使用的 job 名称")
+    group.add_argument("--push-only", action="store_true", help="只推送，不启动 /metrics 服务")
+    group.add_argument("--push-batch-size", type=int, default=DEFAULT_PUSH_BATCH_SIZE,
+                       help="remote write 单个请求最多包含的 series 数")
+    group.add_argument("--push-max-in-flight", type=int, default=DEFAULT_PUSH_MAX_IN_FLIGHT,
+                       help="同时进行的推送请求上限")
+
+
+def build_pushers(args, job: str, shard: shard_filter = None):
+    """
+    :param args: 包含 push_arguments 参数的命令行参数
+    :param job: 未指定 --push-job 时使用的 job 名称
+    :param shard: 本副本的分片信息
+    :return: [推送方式, ...]，未配置推送地址时为空列表
+    """
+    if not (args.remote_write_url or args.pushgateway_url):
+        return []
+    job = args.push_job or job
+    queue = push_queue(max_in_flight=args.push_max_in_flight)
+    queue.start()
+    pushers = []
+    if args.remote_write_url:
+        pushers.append(remote_writer(args.remote_write_url, queue, job, args.push_batch_size, shard))
+    if args.pushgateway_url:
+        pushers.append(pushgateway_pusher(args.pushgateway_url, queue, job, shard))
+    return pushers
+
+
+class snapshot_store:
+    def __init__(
+        self,
+        path: str,
+        watermarks: watermark_store = None,
+        counters: counter_store = None,
+        save_interval: int = DEFAULT_SNAPSHOT_SAVE_INTERVAL,
+    ):
+        """
+        :param path: 快照文件路径，所在目录不存在时自动创建
+        :param watermarks: 与快照一起保存、恢复的 watermark_store
+        :param counters: 与快照一起保存、恢复的 counter_store
+        :param save_interval: 两次写入之间的最小间隔（单位：秒），多个账号同时完成时只写一次
+        """
+        self.path = path
+        self.watermarks = watermarks
+        self.counters = counters
+        self.save_interval = save_interval
+        self._saved = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def header():
+        """
+        :return: 文件头，marshal 数据之前的一行：文件版本与 python 主、次版本号
+        """
+        return b"aliyun-exporter-snapshot %d python-%d.%d\n" % ((SNAPSHOT_FILE_VERSION,) + tuple(sys.version_info[:2]))
+
+    @staticmethod
+    def _dump_snapshot(snapshot: metrics_snapshot):
+        return (
+            snapshot.stale_ttl,
+            [
+                (family.name, family.documentation, family.labelnames, family.metric_type, family.unit,
+                 family.labelvalues, family.values, family.timestamps, family.seen)
+                for family in snapshot.families.values()
+            ],
+        )
+
+    @staticmethod
+    def _load_snapshot(state: tuple):
+        stale_ttl, families = state
+        snapshot = metrics_snapshot(stale_ttl)
+        for name, documentation, labelnames, metric_type, unit, labelvalues, values, timestamps, seen in families:
+            family = snapshot.family(name, documentation, labelnames, metric_type, unit)
+            family.labelvalues = list(labelvalues)
+            family.values = list(values)
+            family.timestamps = list(timestamps)
+            family.seen = list(seen)
+        return snapshot
+
+    def save(self, snapshots: dict, force: bool = False):
+        """
+        :param snapshots: {(产品, 账号名, 区域): (metrics_snapshot, 采集完成时间)}
+        :param force: 忽略 save_interval 立即写入
+        """
+        with self._lock:
+            now = time.time()
+            if not force and now - self._saved < self.save_interval:
+                return
+            self._saved = now
+            content = {
+                "saved": now,
+                "snapshots": [
+                    (key, finished, self._dump_snapshot(snapshot)) for key, (snapshot, finished) in snapshots.items()
+                ],
+                "watermarks": self.watermarks.state() if self.watermarks is not None else {},
+                "counters": self.counters.state() if self.counters is not None else {},
+            }
+            temp_path = self.path + ".tmp"
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(temp_path, "wb") as file:
+                    file.write(self.header())
+                    marshal.dump(content, file)
+                os.replace(temp_path, self.path)
+            except (OSError, ValueError) as e:
+                logging.error(f"快照写入 {self.path} 失败： {e}")
+                return
+        logging.debug(f"快照写入 {self.path}，{len(snapshots)} 个账号，耗时 {time.time() - now:.3f}s")
+
+    def load(self):
+        """
+        读取快照文件，同时恢复 watermark_store、counter_store
+        :return: {(产品, 账号名, 区域): (metrics_snapshot, 采集完成时间)}，文件不存在或无法读取时为空
+        """
+        try:
+            with open(self.path, "rb") as file:
+                # 文件版本或 python 版本不一致时不解析 marshal 数据
+                header = file.readline(256)
+                if header != self.header():
+                    raise ValueError(f"文件头 {header[:64]!r} 与当前 {self.header()!r} 不一致")
+                content = marshal.load(file)
+            snapshots = {
+                tuple(key): (self._load_snapshot(state), finished) for key, finished, state in content["snapshots"]
+            }
+        except FileNotFoundError:
+            return {}
+        except (OSError, EOFError, ValueError, TypeError, KeyError, AttributeError) as e:
+            logging.error(f"快照文件 {self.path} 无法读取，从空快照开始： {e}")
+            return {}
+        if self.watermarks is not None:
+            self.watermarks.restore(content.get("watermarks") or {})
+        if self.counters is not None:
+            self.counters.restore(content.get("counters") or {})
+        logging.info(f"从 {self.path} 恢复 {len(snapshots)} 个账号的快照，保存于 {time.time() - content['saved']:.0f}s 前")
+        return snapshots
+
+
+def snapshot_arguments(parser):
+    """
+    为命令行参数添加快照落盘相关的参数
+    :param parser: argparse.ArgumentParser
+    """
+    group = parser.add_argument_group("snapshot")
+    group.add_argument("--snapshot-file", help="快照文件路径，启动时恢复、每次采集后保存，不指定时不落盘")
+    group.add_argument("--snapshot-save-interval", type=int, default=DEFAULT_SNAPSHOT_SAVE_INTERVAL,
+                       help="快照两次写入之间的最小间隔（单位：秒）")
+
+
+def build_snapshot_store(args, collector=None):
+    """
+    :param args: 包含 snapshot_arguments 参数的命令行参数
+    :param collector: product_collector，其 watermarks、counters 与快照一起保存
+    :return: snapshot_store，未指定 --snapshot-file 时为 None
+    """
+    if not args.snapshot_file:
+        return None
+    return snapshot_store(
+        args.snapshot_file,
+        watermarks=getattr(collector, "watermarks", None),
+        counters=getattr(collector, "counters", None),
+        save_interval=args.snapshot_save_interval,
+    )
+
+
+def cardinality_arguments(parser):
+    """
+    为命令行参数添加 label 基数控制相关的参数
+    :param parser: argparse.ArgumentParser
+    """
+    group = parser.add_argument_group("cardinality")
+    group.add_argument("--cardinality-file", help="label 白名单、黑名单及 series 上限的 yaml 配置文件，格式见 cardinality_policy")
+    group.add_argument("--max-series", type=int, help="每个 metrics 的默认 series 上限，覆盖配置文件中的 default")
+
+
+def build_cardinality_policy(args):
+    """
+    :param args: 包含 cardinality_arguments 参数的命令行参数
+    :return: cardinality_policy，未指定配置文件时只按默认上限限制 series 数
+    """
+    config = {}
+    if args.cardinality_file:
+        with open(args.cardinality_file) as file:
+            config = yaml.safe_load(file) or {}
+    if args.max_series is not None:
+        config["default"] = dict(config.get("default") or {}, max_series=args.max_series)
+    return cardinality_policy(config)
+
+
+class product_collector:
+    def __init__(
+        self,
+        product_classes: list,
+        pool: fetch_pool = None,
+        inventory: inventory_cache = None,
+        clients: client_registry = None,
+        watermarks: watermark_store = None,
+        shard: shard_filter = None,
+        counters: counter_store = None,
+        schedule: refresh_schedule = None,
+    ):
+        """
+        多个产品插件共用的采集入口，作为 collect_scheduler 的 collect_func
+        :param product_classes: 产品插件类列表
+        :param pool: 所有产品共用的线程池，未传入时使用默认配置新建
+        :param inventory: 所有产品共用的清单缓存，未传入时使用默认有效期新建
+        :param clients: 所有产品共用的常驻 AcsClient 仓库，未传入时使用默认配置新建
+        :param watermarks: 各节点/实例已取到的最新数据点时间，未传入时新建
+        :param shard: 本副本负责的分片，未传入时采集全部集群/实例
+        :param counters: transform 监控项的跨周期状态，未传入时新建
+        :param schedule: 各监控项的刷新计划、热点节点/实例，未传入时新建
+        """
+        self.products = {product_class.product: product_class for product_class in product_classes}
+        self.pool = pool or fetch_pool()
+        self.inventory = inventory or inventory_cache()
+        self.clients = clients or client_registry(self.pool.account_limit)
+        self.watermarks = watermarks or watermark_store()
+        self.shard = shard or shard_filter()
+        self.counters = counters or counter_store()
+        self.schedule = schedule or refresh_schedule()
+
+    def load_accounts(self, config_files: dict = None):
+        """
+        读取各产品的账号配置，每个账号标记所属产品
+        :param config_files: {产品名: 配置文件路径}，未指定的产品使用插件的 config_file
+        :return: [账号信息, ...]
+        """
+        config_files = config_files or {}
+        accounts = []
+        for product, product_class in self.products.items():
+            for account in load_accounts(config_files.get(product, product_class.config_file)):
+                accounts.append(dict(account, product=product))
+        return accounts
+
+    def __call__(self, account: dict, deadline: float = None):
+        """
+        每次采集新建插件实例，各账号并行采集时本次采集的中间数据互不影响
+        :return: 该账号的 metrics_snapshot
+        """
+        product_class = self.products[account["product"]]
+        return product_class(
+            self.pool, self.inventory, self.clients, self.watermarks, self.shard, self.counters, self.schedule
+        ).collect(account, deadline)
+
+
+class collect_scheduler:
+    def __init__(
+        self,
+        collect_func,
+        accounts: list,
+        default_interval: int = DEFAULT_INTERVAL,
+        default_timeout: int = None,
+        pushers: list = (),
+        store: snapshot_store = None,
+        policy: cardinality_policy = None,
+        render_interval: float = DEFAULT_RENDER_INTERVAL,
+    ):
+        """
+        :param collect_func: 单账号采集函数，参数为 (账号信息, 截止时间)，返回该账号的 metrics_snapshot
+        :param accounts: 账号列表，可以单独配置 interval、timeout、stale_ttl 字段
+        :param default_interval: 账号未配置 interval 时的采集间隔（单位：秒）
+        :param default_timeout: 账号未配置 timeout 时的单次采集时长上限，默认与采集间隔相同
+        :param pushers: 推送方式列表，每个账号采集完成后推送，见 build_pushers
+        :param store: 快照落盘，启动时恢复上一次的快照，每次采集完成后保存
+        :param policy: label 基数控制，未传入时只按默认上限限制 series 数
+        :param render_interval: /metrics 两次预渲染之间的最小间隔（单位：秒），见 exposition_cache
+        """
+        self.collect_func = collect_func
+        self.accounts = accounts
+        self.default_interval = default_interval
+        self.default_timeout = default_timeout
+        self.pushers = list(pushers)
+        self.store = store
+        self.policy = policy or cardinality_policy()
+
+        # {(产品, 账号名, 区域): (metrics_snapshot, 采集完成时间)}
+        self._snapshots = {}
+        # 从文件恢复、尚未重新采集成功的账号
+        self._restored = set()
+        # {(产品, 账号名, 区域): (最近一次是否成功, 最近一次耗时)}
+        self._status = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+        self.registry = CollectorRegistry(auto_describe=False)
+        self.registry.register(snapshot_collector(self))
+        self.registry.register(snapshot_state_collector(self))
+        self.registry.register(self_registry)
+        self.exposition = exposition_cache(self.registry, render_interval)
+        if self.store is not None:
+            self.restore()
+
+    def restore(self):
+        """
+        恢复快照文件中仍在采集的账号，并立即预渲染
+        """
+        keys = {collect_key(account) for account in self.accounts}
+        restored = {key: value for key, value in self.store.load().items() if key in keys}
+        with self._lock:
+            for key, value in restored.items():
+                self._snapshots.setdefault(key, value)
+                self._restored.add(key)
+        if restored:
+            self.exposition.refresh()
+
+    def restored(self):
+        with self._lock:
+            return set(self._restored)
+
+    def snapshots(self):
+        with self._lock:
+            return dict(self._snapshots)
+
+    def status(self):
+        with self._lock:
+            return dict(self._status)
+
+    def ready(self):
+        """
+        :return: 所有账号都已完成第一次采集（无论成功与否）或已从文件恢复快照时返回 True，用于就绪检查
+        """
+        with self._lock:
+            return all(
+                collect_key(account) in self._status or collect_key(account) in self._restored
+                for account in self.accounts
+            )
+
+    def start(self):
+        thread = threading.Thread(target=self.exposition.render_loop, args=(self._stop,), name="render", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        # 每个账号独立线程，互不阻塞
+        for account in self.accounts:
+            thread = threading.Thread(
+                target=self._run,
+                args=(account,),
+                name=f"collect_{'_'.join(filter(None, collect_key(account)))}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        if self.store is not None:
+            self.store.save(self.snapshots(), force=True)
+
+    def interval(self, account: dict):
+        return int(account.get("interval", self.default_interval))
+
+    def timeout(self, account: dict):
+        return int(account.get("timeout", self.default_timeout or self.interval(account)))
+
+    def collect_once(self, account: dict):
+        """
+        采集单个账号，成功后替换该账号的快照；失败保留上一次快照，只将该账号的 up 置为 0
+        """
+        key = collect_key(account)
+        started, paced = time.time(), paced_seconds()
+        try:
+            snapshot = self.collect_func(account, started + self.timeout(account))
+        except Exception as e:
+            logging.exception(f"账号 {key} 采集失败： {e}")
+            with self._lock:
+                self._status[key] = (0, time.time() - started - (paced_seconds() - paced))
+            self.exposition.invalidate()
+            self.push(key, None, time.time())
+            return
+        finished = time.time()
+        # 分散提交的等待是刻意的，不计入采集耗时
+        duration = finished - started - (paced_seconds() - paced)
+        snapshot.stale_ttl = int(account.get("stale_ttl", DEFAULT_STALE_TTL))
+        snapshot.seal(finished)
+        # 先去掉 label 再与上一次快照合并，合并后再限制一次 series 数
+        self.policy.apply(snapshot)
+        with self._lock:
+            previous = self._snapshots.get(key)
+            snapshot.carry_over(previous and previous[0], finished)
+            self.policy.apply(snapshot)
+            # 整体替换，/metrics 不会读到采集了一半的数据
+            self._snapshots[key] = (snapshot, finished)
+            self._status[key] = (1, duration)
+            self._restored.discard(key)
+        self.exposition.invalidate()
+        self.push(key, snapshot, finished)
+        if self.store is not None:
+            self.store.save(self.snapshots())
+        logging.info(f"账号 {key} 采集完成，耗时 {duration:.2f}s，分散提交等待 {paced_seconds() - paced:.2f}s")
+
+    def push(self, key: tuple, snapshot, finished: float):
+        """
+        推送单个账号的采集结果，推送失败不影响采集
+        """
+        for pusher in self.pushers:
+            try:
+                pusher.push(key, snapshot, finished)
+            except Exception as e:
+                logging.exception(f"账号 {key} 推送失败： {e}")
+
+    def _run(self, account: dict):
+        due = time.time()
+        while not self._stop.wait(max(0, due - time.time())):
+            self.collect_once(account)
+            due = max(time.time(), due + self.interval(account))
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+@desc: 阿里云数据库统一 exporter，一个进程采集多个产品
+1、产品以插件形式注册在 products 中，按需导入，见 aliyun_common.product_collector
+  1.1 polardb：aliyun_polardb.aliyun_polarDB_api
+  1.2 mongodb：aliyun_mongodb.aliyun_mongodb
+  1.3 新增产品（如 RDS）只需实现插件类并在 products 中注册
+2、所有产品共用一个采集调度、线程池、client 仓库、清单缓存和 /metrics 服务
+3、启动参数
+  3.1 --products：采集的产品，逗号分隔，默认全部
+  3.2 --config：指定产品的账号配置文件，格式为 产品=路径，可以重复
+  3.3 推送、分片参数见 aliyun_common.push_arguments / shard_arguments
+4、polarDB-b.py、"mongodb -B.py" 为只采集单个产品的启动入口，端口与之前保持一致
+5、生产环境 WSGI 服务
+  5.1 已安装 waitress 时使用 waitress，否则使用内置的线程池 WSGI 服务，--threads 指定处理请求的线程数
+  5.2 单进程多线程，所有线程共用同一份采集快照，采集只在后台线程中进行
+  5.3 /healthz：进程存活即返回 200；/ready：所有账号完成第一次采集后返回 200，否则 503，均不触发采集
+  5.4 --debug-server 时使用 flask 开发服务，仅用于本地调试
+6、--snapshot-file：快照落盘，重启后立即输出上一次的快照，见 aliyun_common.snapshot_store
+7、--cardinality-file / --max-series：label 白名单、黑名单及每个 metrics 的 series 上限，见 aliyun_common.cardinality_policy
+"""
+
+import argparse
+import importlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from flask import Flask, Response, request
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+from aliyun_common import (
+    DEFAULT_RENDER_INTERVAL,
+    build_cardinality_policy,
+    build_pushers,
+    build_shard,
+    build_snapshot_store,
+    cardinality_arguments,
+    collect_scheduler,
+    metrics_response,
+    product_collector,
+    push_arguments,
+    shard_arguments,
+    snapshot_arguments,
+)
+
+# {产品名: "模块:插件类"}，启动时只导入用到的产品，未安装的产品 sdk 不影响其他产品
+products = {
+    "polardb": "aliyun_polardb:aliyun_polarDB_api",
+    "mongodb": "aliyun_mongodb:aliyun_mongodb",
+}
+
+DEFAULT_THREADS = 8
+
+
+def load_product(name: str):
+    """
+    :param name: products 中的产品名
+    :return: 产品插件类
+    """
+    module_name, class_name = products[name].split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def create_app(scheduler):
+    """
+    :param scheduler: collect_scheduler 实例
+    :return: 输出 /metrics 的 flask app
+    """
+    app = Flask(__name__)
+
+    # 直接输出后台采集后预渲染的快照，不再同步调用阿里云 api
+    @app.route("/metrics")
+    def web():
+        return metrics_response(scheduler.exposition, request)
+
+    # 存活检查，不访问快照
+    @app.route("/healthz")
+    def healthz():
+        return Response("ok\n", mimetype="text/plain")
+
+    # 就绪检查：所有账号完成第一次采集前返回 503，不触发采集
+    @app.route("/ready")
+    def ready():
+        if scheduler.ready():
+            return Response("ready\n", mimetype="text/plain")
+        return Response("collecting\n", status=503, mimetype="text/plain")
+
+    return app
+
+
+class quiet_request_handler(WSGIRequestHandler):
+    # 访问日志写入 logging，不输出到 stderr
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+class pooled_wsgi_server(WSGIServer):
+    """
+    固定线程数的 WSGI 服务：每个连接交给线程池处理，慢请求不阻塞其他抓取，线程数不随并发增长
+    """
+
+    def __init__(self, server_address: tuple, handler_class, threads: int = DEFAULT_THREADS):
+        """
+        :param threads: 处理请求的线程数
+        """
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http")
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def serve(app, port: int, threads: int = DEFAULT_THREADS):
+    """
+    生产环境服务，单进程多线程，所有线程共用同一份快照
+    :param app: flask app
+    :param port: 监听端口
+    :param threads: 处理请求的线程数
+    """
+    if waitress is not None:
+        logging.info(f"使用 waitress 监听 {port}，{threads} 个线程")
+        waitress.serve(app, host="0.0.0.0", port=port, threads=threads)
+        return
+    server = pooled_wsgi_server(("0.0.0.0", port), quiet_request_handler, threads)
+    server.set_app(app)
+    logging.info(f"使用内置线程池 WSGI 服务监听 {port}，{threads} 个线程")
+    server.serve_forever()
+
+
+def main(product_names: list = None, port: int = 19990, log_file: str = "../log/aliyun_exporter.log",
+         log_level: int = logging.INFO, snapshot_file: str = None):
+    """
+    :param product_names: 默认采集的产品，可以被 --products 覆盖
+    :param port: 默认 /metrics 端口，可以被 --port 覆盖
+    :param log_file: 日志文件
+    :param log_level: 日志级别
+    :param snapshot_file: 默认快照文件，可以被 --snapshot-file 覆盖，为 None 时不落盘
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", default=",".join(product_names or products),
+                        help=f"采集的产品，逗号分隔，可选 {', '.join(products)}")
+    parser.add_argument("--config", action="append", default=[], metavar="PRODUCT=PATH",
+                        help="产品的账号配置文件，未指定时使用插件默认的 config_file")
+    parser.add_argument("--port", type=int, default=port, help="/metrics 端口")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="处理 http 请求的线程数")
+    parser.add_argument("--render-interval", type=float, default=DEFAULT_RENDER_INTERVAL,
+                        help="/metrics 两次预渲染之间的最小间隔（单位：秒），期间完成的账号合并渲染")
+    parser.add_argument("--debug-server", action="store_true", help="使用 flask 开发服务，仅用于本地调试")
+    push_arguments(parser)
+    shard_arguments(parser)
+    snapshot_arguments(parser)
+    cardinality_arguments(parser)
+    parser.set_defaults(snapshot_file=snapshot_file)
+    args = parser.parse_args()
+
+    fh = logging.FileHandler(filename=log_file, encoding="utf-8")
+    logging.basicConfig(handlers=[fh], level=log_level, format="%(asctime)s %(levelname)s %(message)s")
+
+    product_classes = [load_product(name.strip()) for name in args.products.split(",") if name.strip()]
+    shard = build_shard(args)
+    collector = product_collector(product_classes, shard=shard)
+    accounts = collector.load_accounts(dict(item.split("=", 1) for item in args.config))
+    # 只采集单个产品时沿用该产品原来的 job 名
+    job = product_classes[0].job if len(product_classes) == 1 else "aliyun_exporter"
+
+    # 先恢复上一次的快照，/metrics 启动后立即可用，新的采集在后台进行
+    scheduler = collect_scheduler(
+        collector,
+        accounts,
+        pushers=build_pushers(args, job, shard),
+        store=build_snapshot_store(args, collector),
+        policy=build_cardinality_policy(args),
+        render_interval=args.render_interval,
+    )
+    scheduler.start()
+    if args.push_only:
+        threading.Event().wait()
+    app = create_app(scheduler)
+    if args.debug_server:
+        # 关闭 reloader，避免启动两个后台采集线程
+        app.run(host="0.0.0.0", port=args.port, debug=True, use_reloader=False)
+    else:
+        serve(app, args.port, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+#-*- coding:utf-8 _*-  
+""" 
+@author: Dennis zhang
+@site:  1、先通过配置文件读取账号信息
+        2、通过账号信息获取下属所有的实例信息，按页拉取，按账号缓存 inventory_interval 秒（默认 600s）
+           实例清单解析为 account_topology（mongodb_instance：instance_id、description），随清单缓存
+        3、通过实例信息获取监控信息，实例、监控项通过有界线程池并发查询
+           查询窗口从该实例已取到的最新数据点开始，只输出最新的数据点及其时间戳
+           批量模式下单个实例的所有监控项合并为一次请求
+        4、整合监控信息，生成metrics
+        5、后台线程按账号 interval 定时采集，/metrics 只输出最近一次的快照
+        6、多账号、多区域并行采集，单个账号失败只影响该账号，
+           采集是否成功见 aliyun_exporter_account_up{product="mongodb"}（取代 aliyun_mongodb_metrics_up）
+        7、AcsClient 按账号、区域常驻复用，跨采集周期保持长连接，
+           请求按账号、action 限速，限流和临时性错误自动退避重试
+        8、采集结果写入 metrics_snapshot，/metrics 由自定义 Collector 直接从快照生成
+        9、可选推送模式：--remote-write-url / --pushgateway-url，每个账号采集完成后推送，
+           --push-only 时不启动 /metrics 服务
+        10、多副本分片：--shard-index/--shard-count，按 (账号, 实例 id) 一致性哈希分配，
+            每个副本只采集自己分片内的实例
+        11、作为产品插件与其他产品共用一个 exporter 进程（aliyun_exporter.py），
+            "mongodb -B.py" 为只采集 MongoDB 的启动入口
+        12、监控项与 metrics 的对应关系见 aliyun_mongodb_metrics.yaml，
+            MongoDB_Opcounters 等返回多个取值的监控项一次请求、一次处理全部取值
+        13、返回值在线程池中直接解析为 performance_point，只保留各 Key 最新数据点（需要 integrate 的 Key
+            同时保留窗口内更早的数据点，逐点累加），
+            数据点时间（Date）的解析结果按字符串缓存，同一分钟的数据点只解析一次
+        14、key_intervals 中的监控项（如 DiskUsage）按各自的间隔刷新，其余监控项在非热点实例上按
+            cold_interval 刷新，没有到期监控项的实例本周期不发请求；超过 hot_thresholds 的实例
+            每个周期查询全部监控项并优先提交；请求在采集间隔的 fetch_spread 比例内均匀提交，
+            见 aliyun_common.refresh_schedule
+
+@software: PyCharm 
+"""
+import os
+import logging
+import time
+import calendar
+import functools
+
+from aliyunsdkcore.acs_exception.exceptions import ClientException
+from aliyunsdkcore.acs_exception.exceptions import ServerException
+from aliyunsdkdds.request.v20151201.DescribeDBInstancePerformanceRequest import DescribeDBInstancePerformanceRequest
+from aliyunsdkdds.request.v20151201.DescribeDBInstancesRequest import DescribeDBInstancesRequest
+
+from aliyun_common import (DEFAULT_FETCH_SPREAD, DEFAULT_INTERVAL, account_key, account_topology, aliyun_time,
+                           client_registry, collect_phase, counter_store, debug_response, decode_response, fetch_pool,
+                           inventory_cache, load_metric_mapping, metrics_snapshot, paginate, parse_values,
+                           performance_point, refresh_schedule, shard_filter, watermark_store)
+
+
+@functools.lru_cache(maxsize=4096)
+def utc_timestamp(date: str):
+    """
+    :param date: 数据点时间，如 2020-12-03T08:10:00Z（UTC时间），所有实例同一分钟的数据点时间相同
+    :return: 时间戳（单位：秒）
+    """
+    return calendar.timegm(time.strptime(date, "%Y-%m-%dT%H:%M:%SZ"))
+
+
+class mongodb_instance:
+    __slots__ = ("instance_id", "description")
+
+    def __init__(self, one_instance: dict):
+        """
+        :param one_instance: DescribeDBInstances 返回的 DBInstances.DBInstance 中的单个实例
+        """
+        self.instance_id = one_instance["DBInstanceId"]
+        # 实例描述为空则使用实例id
+        self.description = one_instance.get("DBInstanceDescription", self.instance_id)
+
+
+class aliyun_mongodb:
+    # 产品插件信息，见 aliyun_common.product_collector
+    product = "mongodb"
+    job = "aliyun_mongodb"
+    # 账号配置文件，账号的 name 字段作为 account label，未配置时使用 accessKeyId 的短别名（见 aliyun_common.key_alias）
+    config_file = "./aliyun_mongodb_config.yaml"
+
+    # 监控项与 metrics 的对应关系，每个实例查询其中的全部监控项
+    metrics_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "aliyun_mongodb_metrics.yaml")
+    # 所有监控项 metrics 固定输出的 label
+    base_labelnames = ("account", "db_instance_id", "db_instance_desc", "metrics_name")
+    # 变化慢的监控项单独的刷新间隔（单位：秒），需小于 stale_ttl（默认 300s）
+    key_intervals = {
+        "DiskUsage": 240,
+    }
+    # 非热点实例其余监控项的刷新间隔（单位：秒），为 None 时每个采集周期都查询，需小于 stale_ttl
+    cold_interval = 120
+    # 热点阈值 {Key: 阈值}，多个取值时取最大值，不小于阈值的实例每个周期查询全部监控项，并优先查询
+    hot_thresholds = {
+        "CpuUsage": 80,
+        "MemoryUsage": 90,
+    }
+    # 批量模式：单个实例的所有监控项通过一次 DescribeDBInstancePerformance 请求获取
+    batch_keys = True
+    # 实例没有已取到的数据点时，向前查询的时间（单位：秒）
+    lookback = 600
+
+    def __init__(self, pool: fetch_pool = None, inventory: inventory_cache = None, clients: client_registry = None,
+                 watermarks: watermark_store = None, shard: shard_filter = None, counters: counter_store = None,
+                 schedule: refresh_schedule = None):
+        """
+        :param pool: 并发查询使用的线程池，未传入时使用默认配置新建
+        :param inventory: 实例清单缓存，未传入时使用默认有效期新建
+        :param clients: 常驻 AcsClient 仓库，未传入时使用默认配置新建
+        :param watermarks: 各实例已取到的最新数据点时间，未传入时新建
+        :param shard: 本副本负责的实例分片，未传入时采集全部实例
+        :param counters: transform 监控项（如 MongoDB_Opcounters）的跨周期状态，未传入时新建
+        :param schedule: 各实例监控项的刷新计划、热点实例，未传入时新建
+        """
+        self.pool = pool or fetch_pool()
+        self.inventory = inventory or inventory_cache()
+        self.clients = clients or client_registry(self.pool.account_limit)
+        self.watermarks = watermarks or watermark_store()
+        self.shard = shard or shard_filter()
+        self.counters = counters or counter_store()
+        self.schedule = schedule or refresh_schedule()
+        # 同一文件只在第一次使用时编译
+        self.mapping = load_metric_mapping(self.metrics_file, self.base_labelnames)
+        self.performance_keys = tuple(self.mapping.keys)
+        self.intervals = refresh_schedule.intervals(self.performance_keys, self.key_intervals, self.cold_interval)
+
+    def time_window(self, scope: tuple, horizon: float = None):
+        """
+        计算单个实例本次查询的时间窗口：从该实例已取到的最新数据点开始，到当前时间为止，
+        没有记录时向前查询 lookback 秒
+        :param scope: (账号名, 区域, 实例id)
+        :param horizon: 只考虑最近 horizon 秒内的数据点记录，见 watermark_store.start_time
+        :return: (start_time, end_time)
+        """
+        start_time = self.watermarks.start_time(scope, self.lookback, horizon)
+        return aliyun_time(start_time), aliyun_time(time.time())
+
+    def init_snapshot(self):
+        """
+        初始化本次采集使用的监控项 metrics
+        :return: metrics_snapshot
+        """
+        self.snapshot = metrics_snapshot()
+        return self.snapshot
+
+    def init_account_info(self, key_id:str, secret:str, region:str, account_name:str = None):
+        """
+        初始化阿里云授权账号
+        :param key_id: accessKeyId 字段，授权账户
+        :param secret: accessSecret 字段，授权密码
+        :param region: 区域信息
+        :param account_name: 账号名，用于自身运行状态 metrics
+        :return: 常驻的 client 实例，跨采集周期复用连接
+        """
+        return self.clients.get(key_id, secret, region, account_name)
+
+    def get_account_instance_info(self, client: object):
+        """
+        :param client: 账号实例
+        通过账号查询下属所有的实例信息
+        :return: account_topology，所有页的实例
+        """
+
+        # 按页拉取全部实例，将多个返回值中实例 ID 筛选出，返回列表
+        try:
+            db_instance_list = paginate(client, DescribeDBInstancesRequest, ("DBInstances", "DBInstance"))
+        except (KeyError, Exception) as e:
+            logging.error(f"返回值异常，请检查！ {e}")
+            raise RuntimeError("监控账号获取实例ID失败！")
+
+        # 改动：单个实例解析为 mongodb_instance，整个账号的实例组成 account_topology
+        try:
+            topology = account_topology(instances=[mongodb_instance(one_instance) for one_instance in db_instance_list])
+
+        except KeyError as e:
+            logging.error(f"推测账号信息返回值为空，请检查 {e}")
+            logging.error(f"阿里云返回 instance list 信息为 {db_instance_list}")
+            raise RuntimeError("获取数据疑似为空！")
+        except Exception as exceptions:
+            logging.error(f"获取实例 ID 过程发生异常，请检查！ {exceptions}")
+            raise RuntimeError("其他类型错误！")
+
+        return topology
+
+
+    def deal_with_metrcis_info(self, requests: dict):
+        """
+        阿里云 DescribeDBInstancePerformance 参数返回模板抽象，都通过该函数处理返回字段，最终返回value
+        :param request: 阿里云返回的所有数据信息，一次请求多个 Key 时按 Key 拆分
+        :return: [performance_point(Key, 最新数据点的取值元组, 数据点时间（秒）, ValueFormat), ...]，
+            取值见 parse_values，取值不是数字的数据点被丢弃；需要 integrate 的 Key 同时保留窗口内更早的数据点
+        简单格式如下
+        {
+        "PerformanceKeys": {
+            "PerformanceKey": [
+                {
+                    "ValueFormat": "mem_usage",
+                    "PerformanceValues": {
+                        "PerformanceValue": [
+                            {
+                                "Value": "27.62",
+                                "Date": "2020-12-03T08:10:00Z"
+                            },]
+                    },
+                    "Unit": "%",
+                    "Key": "MemoryUsage"
+                    }
+                ]
+            },
+        "RequestId": "E83B82DC-64D1-4843-BA34-7753D7EC08AF",
+        "EndTime": "2020-12-03T08:16Z",
+        "StartTime": "2020-12-03T08:11Z"
+        }
+        """
+        # 从阿里返回值中获取每个 Key 最新数据点的 value 值，Date 为 UTC 时间
+        values = []
+        try:
+            for performance_key in requests["PerformanceKeys"]["PerformanceKey"]:
+                performance_value = performance_key["PerformanceValues"]["PerformanceValue"]
+                if not performance_value:
+                    continue
+                newest = max(performance_value, key=lambda point: point["Date"])
+                try:
+                    value = parse_values(newest["Value"])
+                except (AttributeError, TypeError, ValueError):
+                    # 取值为 null、N/A 等时只丢弃该 Key，不影响同一返回值中的其他 Key
+                    logging.warning(f"监控项 {performance_key['Key']} 取值 {newest['Value']!r} 不是数字，已丢弃")
+                    continue
+                earlier = ()
+                if performance_key["Key"] in self.mapping.integrated_keys:
+                    earlier = self.earlier_points(performance_key["Key"], performance_value, newest)
+                values.append(performance_point(
+                    performance_key["Key"], value, utc_timestamp(newest["Date"]), performance_key["ValueFormat"],
+                    earlier,
+                ))
+        except (KeyError, Exception) as e:
+            logging.error(f"返回值异常，请检查！ {e}")
+            logging.error(f"阿里云原始返回数据为： {requests}")
+            raise RuntimeError("阿里云返回全部字段处理失败！")
+
+        return values
+
+    @staticmethod
+    def earlier_points(key: str, performance_value: list, newest: dict):
+        """
+        integrate 需要逐点累加，只用最新数据点时会把它的每秒平均值乘以整个间隔
+        :param performance_value: 单个 Key 在查询窗口内的全部数据点
+        :param newest: 其中最新的数据点
+        :return: ((取值元组, 数据点时间), ...)，按时间升序，不含 newest，取值不是数字的数据点被丢弃
+        """
+        earlier = []
+        for point in sorted(performance_value, key=lambda point: point["Date"]):
+            if point is newest:
+                continue
+            try:
+                earlier.append((parse_values(point["Value"]), utc_timestamp(point["Date"])))
+            except (AttributeError, TypeError, ValueError):
+                logging.warning(f"监控项 {key} 取值 {point['Value']!r} 不是数字，已丢弃")
+        return tuple(earlier)
+
+    def get_metrcics_info(self, client: object, db_instance_id: str, key: str, window: tuple):
+        """
+        获取实例的各项监控指标使用情况，在线程池中并发执行
+        :key 值不固定详情见 https://www.alibabacloud.com/help/zh/doc-detail/64048.htm
+        :param key: 指标类型，多个指标以逗号分隔，一次请求全部返回
+        :param db_instance_id: 实例id
+        :param client: client 实例
+        :param window: (start_time, end_time)，time_window 的返回值
+        :return: [performance_point, ...]，请求失败（重试耗尽）或返回值异常时返回空列表，不影响其他实例
+        """
+        request = DescribeDBInstancePerformanceRequest()
+        request.set_accept_format('json')
+        request.set_Key(key)
+        request.set_StartTime(window[0])
+        request.set_EndTime(window[1])
+        request.set_DBInstanceId(db_instance_id)
+
+        try:
+            response = client.do_action_with_exception(request)
+        except (ServerException, ClientException) as e:
+            logging.error(f"实例 {db_instance_id} 获取监控项 {key} 失败： {e}")
+            return []
+        debug_response("DescribeDBInstancePerformance", response)
+
+        try:
+            return self.deal_with_metrcis_info(decode_response(response))
+        except Exception as e:
+            # 返回值异常时只丢弃该实例本次的数据，不影响账号下其他实例
+            logging.error(f"实例 {db_instance_id} 监控项 {key} 返回值处理失败： {e}")
+            return []
+
+    def init_metrics(self, db_instance_id: str, db_instance_desc: str, account: str, values: dict):
+        """
+        将单个实例的监控值写入本次快照
+        :param db_instance_id: 实例id
+        :param db_instance_desc: 实例描述信息
+        :param account: 账号信息，用域生成metrics
+        :param values: get_metrcics_info 的返回值，只包含比上次更新的数据点
+        :return: none
+        """
+        for point in values:
+            self.mapping.add(
+                self.snapshot, (account, db_instance_id, db_instance_desc, point.key), point.key, point.value_format,
+                point.value, point.timestamp, self.counters, point.earlier
+            )
+
+    def key_groups(self, keys: list = None):
+        """
+        批量模式下本次到期的监控项合并为一次请求，否则每个监控项单独请求
+        :param keys: 本次查询的监控项，默认全部
+        :return: [key, ...]
+        """
+        keys = self.performance_keys if keys is None else keys
+        if not keys:
+            return []
+        if self.batch_keys:
+            return [",".join(keys)]
+        return list(keys)
+
+    def collect(self, one_account: dict, deadline: float = None):
+        """
+        采集单个账号下所有实例的监控信息，由后台调度线程调用
+        :param one_account: 配置文件中的单个账号信息
+        :param deadline: 本次采集的截止时间，超时未完成的查询会被取消
+        :return: 该账号的 metrics_snapshot
+        """
+        snapshot = self.init_snapshot()
+        name, region = account_key(one_account)
+
+        client = self.init_account_info(one_account["accessKeyId"],
+                                        one_account["accessSecret"],
+                                        one_account["RegionId"],
+                                        name)
+        with collect_phase(one_account, "inventory"):
+            # 实例清单缓存有效期内不再调用 DescribeDBInstances
+            topology = self.inventory.get(one_account, lambda: self.get_account_instance_info(client))
+            # 多副本时只采集本副本分片内的实例
+            topology = topology.owned(self.shard, name)
+
+        # 为各个实例并发查询相应的监控项信息
+        # 只查询本次到期的监控项，热点实例排在最前面
+        with collect_phase(one_account, "fetch"):
+            scopes = [(name, region, one_instance.instance_id) for one_instance in topology.instances]
+            interval = int(one_account.get("interval", DEFAULT_INTERVAL))
+            instances = []
+            tasks = []
+            for index in self.schedule.order(scopes):
+                due = self.schedule.due_keys(scopes[index], self.performance_keys, self.intervals, interval / 2)
+                if not due:
+                    continue
+                # 本次不查询的慢监控项不拉长查询窗口
+                horizon = max([self.intervals.get(key, 0) for key in due]) + interval * 2
+                window = self.time_window(scopes[index], horizon)
+                for key in self.key_groups(due):
+                    instances.append((index, key.split(",")))
+                    tasks.append((client, scopes[index][2], key, window))
+            # 请求在采集间隔的 fetch_spread 比例内均匀提交，热点实例在最前面
+            spread = interval * float(one_account.get("fetch_spread", DEFAULT_FETCH_SPREAD))
+            results = self.pool.map(one_account, self.get_metrcics_info, tasks, deadline, spread)
+
+        # 查询结果统一在本线程写入快照，只写入比上次更新的数据点，其余沿用上一次快照
+        with collect_phase(one_account, "build"):
+            for (index, keys), values in zip(instances, results):
+                if not values:
+                    continue
+                one_instance = topology.instances[index]
+                self.schedule.fetched(scopes[index], keys, self.intervals)
+                for point in values:
+                    threshold = self.hot_thresholds.get(point.key)
+                    if threshold is None:
+                        continue
+                    if max(value or 0 for value in point.value) >= threshold:
+                        self.schedule.heat(scopes[index])
+                newer = [
+                    point for point in values
+                    if self.watermarks.advance(scopes[index], point.key, point.timestamp)
+                ]
+                self.init_metrics(one_instance.instance_id, one_instance.description, name, newer)
+
+        return snapshot
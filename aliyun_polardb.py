@@ -0,0 +1,615 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@author: Dennis
+@desc: 通过阿里云 api 获取对应状态值
+1、通过账号获取账号下的集群、节点信息
+  1.1 aciton = DescribeDBClustersRequest，按 PageNumber/PageSize 翻页拉取，
+      集群信息按账号缓存，有效期为 inventory_interval（默认 600s）
+  1.2 清单拉取后一次性解析为 account_topology，随清单缓存，有效期内不再解析
+    polardb_cluster：cluster_id、description、node_class（产品规格）、storage_used 等集群信息
+      nodes：[polardb_node：node_id、role（节点身份）、node_class 等节点信息]
+
+2、通过信息取获取指定的参数值，action=DescribeDBNodePerformance
+  2.1 时间默认为 60s，之后从该节点已取到的最新数据点开始查询，只输出最新的数据点及其时间戳
+  2.2 cpu 和 disk 涉及到 集群信息，连接数会通过集群规模判断
+  2.3 最大连接数、最大存储与集群配置成正相关
+    2核4G：5T  1200连接数？？？
+    2核8G：5T  1200连接数
+    4核16G：10T  5000连接数
+    8核32G：10T  10000连接数
+    8核64G：30T  10000连接数
+    32核256G：50T  64000连接数
+    各规格的取值见 aliyun_polardb_capacity.yaml，启动时编译为 capacity_index，
+    未列出的规格按核数、内存回退到最接近的一档，每个集群只查找一次
+  2.4 通过返回值生成新字典，新建函数处理各个字典，生成metrics
+  2.5 所有节点、监控项的查询通过有界线程池并发执行，单账号、单区域并发数有上限
+  2.6 批量模式下单个节点的所有监控项合并为一次请求，Key 以逗号分隔
+  2.7 返回值在线程池中直接解析为 performance_point，只保留各监控项最新数据点，见 aliyun_common.decode_response
+  2.8 key_intervals 中的监控项（如 PolarDBDiskUsage）按各自的间隔刷新，其余监控项在非热点节点上按
+      cold_interval 刷新，没有到期监控项的节点本周期不发请求；超过 hot_thresholds 的节点
+      每个周期查询全部监控项并优先提交；请求在采集间隔的 fetch_spread 比例内均匀提交，
+      见 aliyun_common.refresh_schedule
+  2.9 aliyun_polarDB_meta 只保留不随时间变化的 label，会变化的取值单独输出，避免每次变化产生新的 series：
+    aliyun_polarDB_storage_used_bytes：已使用存储空间
+    aliyun_polarDB_max_connections、aliyun_polarDB_max_storage_gigabytes：规格对应的最大连接数、最大存储空间
+    aliyun_polarDB_cluster_status：集群状态，取值为 1
+    以上由集群清单生成的 metrics 每个周期完整输出，不沿用上一次快照，
+    状态变化、主备切换（DBNodeRole）后旧的 series 立即消失
+
+3、搜集返回值，拼接成web
+  3.1 后台线程按账号 interval 定时采集，/metrics 直接输出最近一次的快照
+  3.2 账号从 yaml 配置文件读取，多账号、多区域并行采集，单个账号失败不影响其他账号
+  3.3 AcsClient 按账号、区域常驻复用，跨采集周期保持长连接，
+      请求按账号、action 限速，限流和临时性错误自动退避重试
+  3.4 采集结果写入 metrics_snapshot，/metrics 由自定义 Collector 直接从快照生成
+  3.5 可选推送模式：--remote-write-url / --pushgateway-url，每个账号采集完成后推送，
+      --push-only 时不启动 /metrics 服务
+  3.6 多副本分片：--shard-index/--shard-count，按 (账号, 集群 id) 一致性哈希分配，
+      每个副本只采集自己分片内的集群
+  3.7 作为产品插件与其他产品共用一个 exporter 进程（aliyun_exporter.py），
+      polarDB-b.py 为只采集 PolarDB 的启动入口
+"""
+
+
+import os
+import time, logging
+import threading
+
+import yaml
+from aliyunsdkcore.acs_exception.exceptions import ClientException
+from aliyunsdkcore.acs_exception.exceptions import ServerException
+from aliyunsdkpolardb.request.v20170801.DescribeDBNodePerformanceRequest import (
+    DescribeDBNodePerformanceRequest,
+)
+from aliyunsdkpolardb.request.v20170801.DescribeDBClustersRequest import (
+    DescribeDBClustersRequest,
+)
+from aliyun_common import (
+    DEFAULT_FETCH_SPREAD,
+    DEFAULT_INTERVAL,
+    account_key,
+    account_topology,
+    aliyun_time,
+    client_registry,
+    collect_phase,
+    counter_store,
+    debug_response,
+    decode_response,
+    fetch_pool,
+    intern_text,
+    inventory_cache,
+    metrics_snapshot,
+    paginate,
+    performance_point,
+    refresh_schedule,
+    shard_filter,
+    watermark_store,
+)
+
+
+class node_capacity:
+    __slots__ = ("max_connect", "max_date")
+
+    def __init__(self, max_connect: int, max_date: int):
+        """
+        :param max_connect: 最大连接数
+        :param max_date: 最大存储空间（单位：GB）
+        """
+        self.max_connect = int(max_connect)
+        self.max_date = int(max_date)
+
+
+class capacity_index:
+    def __init__(self, content: dict):
+        """
+        节点规格 → 最大连接数、最大存储空间
+        :param content: aliyun_polardb_capacity.yaml 的内容，包含 sizes、classes、default
+        """
+        self.sizes = {name: int(cores) for name, cores in (content.get("sizes") or {}).items()}
+        self.default = node_capacity(**content["default"])
+        # {规格: node_capacity}，未列出的规格第一次查找后也记录在这里
+        self._classes = {
+            node_class: node_capacity(**capacity) for node_class, capacity in (content.get("classes") or {}).items()
+        }
+        # [(核数, 内存, node_capacity)]，按规格从小到大排列，用于未列出规格的回退
+        self._shapes = sorted(
+            (shape + (capacity,) for node_class, capacity in self._classes.items()
+             for shape in [self.shape(node_class)] if shape is not None),
+            key=lambda item: item[:2],
+        )
+        self._lock = threading.Lock()
+
+    def shape(self, node_class: str):
+        """
+        :param node_class: 规格，如 polar.mysql.x4.large
+        :return: (核数, 内存（GB）)，无法解析时为 None
+        """
+        parts = node_class.split(".")
+        if len(parts) < 4:
+            return None
+        family, size = parts[-2], parts[-1]
+        ratio = family.lstrip("abcdefghijklmnopqrstuvwxyz")
+        cores = self.sizes.get(size)
+        if cores is None and size.endswith("xlarge") and size[:-len("xlarge")].isdigit():
+            cores = int(size[:-len("xlarge")]) * self.sizes.get("xlarge", 0)
+        if not cores or not ratio.isdigit():
+            return None
+        return cores, cores * int(ratio)
+
+    def get(self, node_class: str):
+        """
+        :param node_class: 规格
+        :return: node_capacity；未列出的规格取核数、内存都不超过该规格的最大一档，优先同一族，都没有时为 default
+        """
+        capacity = self._classes.get(node_class)
+        if capacity is not None:
+            return capacity
+        capacity = self.default
+        shape = self.shape(node_class) if node_class else None
+        if shape is not None:
+            # 优先取同一族（每核内存相同）的规格
+            smaller = [item for item in self._shapes if item[0] <= shape[0] and item[1] <= shape[1]]
+            same_family = [item for item in smaller if item[1] * shape[0] == shape[1] * item[0]]
+            if same_family or smaller:
+                capacity = (same_family or smaller)[-1][2]
+        logging.warning(
+            f"规格 {node_class} 未配置最大连接数、存储空间，使用 {capacity.max_connect} 连接、{capacity.max_date} GB"
+        )
+        with self._lock:
+            self._classes[node_class] = capacity
+        return capacity
+
+
+_capacity_indexes = {}
+_capacity_indexes_lock = threading.Lock()
+
+
+def load_capacity_index(path: str):
+    """
+    读取并编译 yaml 中的规格容量，同一文件只编译一次
+    :param path: yaml 文件路径
+    :return: capacity_index
+    """
+    with _capacity_indexes_lock:
+        index = _capacity_indexes.get(path)
+        if index is None:
+            with open(path) as file:
+                index = _capacity_indexes[path] = capacity_index(yaml.safe_load(file))
+        return index
+
+
+class polardb_node:
+    __slots__ = ("node_id", "role", "zone_id", "region_id", "node_class")
+
+    def __init__(self, one_node: dict):
+        """
+        :param one_node: DescribeDBClusters 返回的 DBNodes.DBNode 中的单个节点
+        """
+        self.node_id = one_node["DBNodeId"]
+        self.role = intern_text(one_node["DBNodeRole"])
+        self.zone_id = intern_text(one_node["ZoneId"])
+        self.region_id = intern_text(one_node["RegionId"])
+        self.node_class = intern_text(one_node["DBNodeClass"])
+
+
+class polardb_cluster:
+    __slots__ = (
+        "cluster_id",
+        "description",
+        "zone_id",
+        "resource_group_id",
+        "status",
+        "create_time",
+        "db_type",
+        "db_version",
+        "node_class",
+        "storage_used",
+        "nodes",
+    )
+
+    def __init__(self, one_cluster: dict):
+        """
+        :param one_cluster: DescribeDBClusters 返回的 Items.DBCluster 中的单个集群
+        """
+        self.cluster_id = one_cluster["DBClusterId"]
+        self.description = one_cluster.get("DBClusterDescription", "")
+        self.zone_id = intern_text(one_cluster["ZoneId"])
+        self.resource_group_id = intern_text(one_cluster["ResourceGroupId"])
+        self.status = intern_text(one_cluster["DBClusterStatus"])
+        self.create_time = one_cluster["CreateTime"]
+        self.db_type = intern_text(one_cluster["DBType"])
+        self.db_version = intern_text(one_cluster["DBVersion"])
+        self.node_class = intern_text(one_cluster["DBNodeClass"])
+        # 已使用存储空间（单位：字节），部分集群不返回
+        self.storage_used = one_cluster.get("StorageUsed")
+        self.nodes = tuple(polardb_node(one_node) for one_node in one_cluster["DBNodes"]["DBNode"])
+
+    def disk_usage(self):
+        """
+        :return: 已使用存储空间（单位：GB），与 max_date 比较得到磁盘使用率
+        """
+        return int(self.storage_used or 0) / 1024 / 1024 / 1000
+
+
+class aliyun_polarDB_api:
+    # 产品插件信息，见 aliyun_common.product_collector
+    product = "polardb"
+    job = "aliyun_polardb"
+    # 访问账号配置文件：
+    # config_file:
+    #   - accessKeyId: ""
+    #     accessSecret: ""
+    #     name: ""                 # 账号名，用于 label，未配置时使用 accessKeyId 的短别名
+    #     RegionId: ["cn-hangzhou", "cn-shanghai"]   # 单个区域或区域列表
+    #     interval: 60             # 采集间隔（单位：秒）
+    #     inventory_interval: 600  # 集群清单缓存有效期（单位：秒）
+    #     timeout: 60              # 单次采集时长上限（单位：秒）
+    config_file = "./aliyun_polarDB_config.yaml"
+    # 节点规格对应的最大连接数、最大存储空间
+    capacity_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "aliyun_polardb_capacity.yaml")
+
+    # 每个节点需要查询的监控项
+    performance_keys = (
+        "PolarDBDiskUsage",
+        "PolarDBConnections",
+        "PolarDBCPU",
+        "PolarDBReplicaLag",
+    )
+    # 变化慢的监控项单独的刷新间隔（单位：秒），需小于 stale_ttl（默认 300s）
+    key_intervals = {
+        "PolarDBDiskUsage": 240,
+    }
+    # 非热点节点其余监控项的刷新间隔（单位：秒），为 None 时每个采集周期都查询，需小于 stale_ttl
+    cold_interval = 120
+    # 热点阈值 {MetricName: 阈值}，MetricName 为返回值中的名称（不是请求的 Key），
+    # 取值不小于阈值的节点每个周期查询全部监控项，并优先查询
+    hot_thresholds = {
+        "mean_cpu_ratio": 80,
+        "mean_replica_lag": 10,
+    }
+    # 批量模式：单个节点的所有监控项通过一次 DescribeDBNodePerformance 请求获取
+    batch_keys = True
+    # 节点没有已取到的数据点时，向前查询的时间（单位：秒）
+    time_interval = 30
+
+    def __init__(
+        self,
+        pool: fetch_pool = None,
+        inventory: inventory_cache = None,
+        clients: client_registry = None,
+        watermarks: watermark_store = None,
+        shard: shard_filter = None,
+        counters: counter_store = None,
+        schedule: refresh_schedule = None,
+    ):
+        """
+        :param pool: 并发查询使用的线程池，未传入时使用默认配置新建
+        :param inventory: 集群清单缓存，未传入时使用默认有效期新建
+        :param clients: 常驻 AcsClient 仓库，未传入时使用默认配置新建
+        :param watermarks: 各节点已取到的最新数据点时间，未传入时新建
+        :param shard: 本副本负责的集群分片，未传入时采集全部集群
+        :param counters: 需要跨周期计算的监控项状态，未传入时新建
+        :param schedule: 各节点监控项的刷新计划、热点节点，未传入时新建
+        """
+        self.pool = pool or fetch_pool()
+        self.inventory = inventory or inventory_cache()
+        self.clients = clients or client_registry(self.pool.account_limit)
+        self.watermarks = watermarks or watermark_store()
+        self.shard = shard or shard_filter()
+        self.counters = counters or counter_store()
+        self.schedule = schedule or refresh_schedule()
+        self.intervals = refresh_schedule.intervals(self.performance_keys, self.key_intervals, self.cold_interval)
+
+        # 同一文件只在第一次使用时编译
+        self.capacities = load_capacity_index(self.capacity_file)
+
+    def init_client(self, access_key_id: str, access_key_secret: str, region_id: str, account_name: str = None):
+        """
+        :param access_key_id:
+        :param access_key_secret:
+        :param region_id:
+        :param account_name: 账号名，用于自身运行状态 metrics
+        :return: 常驻的 AcsClient，跨采集周期复用连接
+        """
+        return self.clients.get(access_key_id, access_key_secret, region_id, account_name)
+
+    # 执行子节点查询 连接数、复制延迟、cpu使用率、磁盘使用率
+    def get_polardb_performance(
+        self, client, node_id: str, metrics_name, time_interval: int = 30, start_time: float = None
+    ):
+        """
+        :param client: 初始化后得aliyun api client 实例
+        :param time_interval: 获取数据的时间间隔，默认为 60秒 （单位：秒）
+        :param metrics_name: 请求监控项的名称，返回对应状态值，多个监控项以逗号分隔
+        :param node_id 节点id，必填项
+        :param start_time: 查询开始时间（单位：秒），为该节点已取到的最新数据点时间，
+                           为 None 时从 time_interval 之前开始
+        时间格式：格式：yyyy-MM-ddTHH:mmZ（UTC时间）
+
+        :return: [performance_point, ...]，deal_performance_rep 的返回值，请求失败（重试耗尽）或返回值异常时为空列表
+        """
+        try:
+            request = DescribeDBNodePerformanceRequest()
+            request.set_accept_format("json")
+
+            localtime = int(time.time())
+            if start_time is None:
+                start_time = localtime - int(time_interval)
+            request.set_DBNodeId(node_id)
+            request.set_StartTime(aliyun_time(start_time))
+            request.set_EndTime(aliyun_time(localtime))
+            request.set_Key(metrics_name)
+
+            response = client.do_action_with_exception(request)
+            debug_response("DescribeDBNodePerformance", response)
+        except ServerException as se:
+            logging.error(se.error_code + " : " + se.message)
+        except ClientException as ce:
+            logging.error(ce.error_code + " : " + ce.message)
+        else:
+            try:
+                return self.deal_performance_rep(decode_response(response))
+            except ValueError as e:
+                # 返回值不是合法的 json 时只丢弃该节点本次的数据，不影响账号下其他节点
+                logging.error(f"节点 {node_id} 返回值解析失败： {e}")
+        return []
+
+    # 批量模式下本次到期的监控项以逗号拼接为一次请求，否则每个监控项单独请求
+    def key_groups(self, keys=None):
+        keys = self.performance_keys if keys is None else keys
+        if not keys:
+            return []
+        if self.batch_keys:
+            return [",".join(keys)]
+        return list(keys)
+
+    # 处理阿里云返回的请求数据，返回该节点本次的监控数据
+    def deal_performance_rep(self, reponens):
+        """
+        :param reponens: 解析后的阿里云返回值，批量请求时包含多个监控项
+        :return: [performance_point(<监控项>, <最新数据点的值>, <数据点时间（秒）>),]，取值不是数字的数据点被丢弃
+        """
+        performance = []
+        # 以 PolarDBDiskUsage 为例会返回多个数据值，需挨个处理
+        try:
+            for one_mesure in reponens["PerformanceKeys"]["PerformanceItem"]:
+                points = one_mesure["Points"]["PerformanceItemValue"]
+                if not points:
+                    continue
+                # 查询窗口内有多个数据点，只取最新的一个，Timestamp 单位为毫秒
+                newest = max(points, key=lambda point: int(point["Timestamp"]))
+                try:
+                    value = float(newest["Value"])
+                except (TypeError, ValueError):
+                    # 取值为 null、N/A 等时只丢弃该监控项，不影响同一返回值中的其他监控项
+                    logging.warning(f"监控项 {one_mesure['MetricName']} 取值 {newest['Value']!r} 不是数字，已丢弃")
+                    continue
+                performance.append(
+                    performance_point(one_mesure["MetricName"], value, int(newest["Timestamp"]) / 1000)
+                )
+        except (KeyError, TypeError, ValueError) as e:
+            # 返回值结构异常时保留已解析的监控项，不抛出，避免整个账号采集失败
+            logging.error(f"返回值结构异常，请检查！ {e}")
+        return performance
+
+    # 通过单个节点本次的监控数据，根据各个监控项判断后，生成metrics 数据
+    def init_metrics(
+        self, metrics_registry, performance, cluster_id="", node_id="", capacity: node_capacity = None, **kwargs
+    ):
+        """
+        :param performance: 该节点本次的监控数据，deal_performance_rep 的返回值
+        :param cluster_id,node_id 为了填充到metrics中
+        :param capacity: 集群规格的 node_capacity，用于计算连接数使用率
+        :param metrics_registry: 本次快照中的 metric_family，会出现生成多个监控项的情况
+        :return:
+        """
+        DBClusterDescription = kwargs.get("DBClusterDescription", "")
+        max_connect = (capacity or self.capacities.default).max_connect
+        for one in performance:
+            metrics_name = one.key
+            metrics_value = one.value
+            if metrics_name == "mean_active_session":
+                connect_rate = metrics_value / max_connect
+                metrics_registry.add(
+                    (cluster_id, node_id, "connect_rate", DBClusterDescription),
+                    connect_rate,
+                    one.timestamp,
+                )
+            metrics_registry.add(
+                (cluster_id, node_id, metrics_name, DBClusterDescription),
+                metrics_value,
+                one.timestamp,
+            )
+
+    # 保存所有集群信息的metrics
+    def save_cluster_info(self, topology: account_topology):
+        """
+        :param topology: 本副本负责的集群清单
+        """
+        for one in topology.clusters:
+            capacity = self.capacities.get(one.node_class)
+            cluster_labels = (one.cluster_id, one.description)
+            self.cluster_status.add(cluster_labels + (one.status,), 1)
+            self.max_connections.add(cluster_labels, capacity.max_connect)
+            self.max_storage.add(cluster_labels, capacity.max_date)
+            if one.storage_used is not None:
+                self.storage_used.add(cluster_labels, one.storage_used)
+            for one_node in one.nodes:
+                self.cluster_info_p.add(
+                    (
+                        one.zone_id,
+                        one.resource_group_id,
+                        one.create_time,
+                        one.cluster_id,
+                        one.description,
+                        one.db_type,
+                        one_node.node_class,
+                        one.db_version,
+                        one_node.zone_id,
+                        one_node.role,
+                        one_node.region_id,
+                        one_node.node_id,
+                    ),
+                    1,
+                )
+
+    # 通过api查询该账号下所有授权的集群信息，按页拉取全部集群
+    def get_cluster_info(self, client):
+        """
+        :return: account_topology，所有页的集群及其节点，请求失败时为 None
+        """
+        try:
+            clusters = paginate(client, DescribeDBClustersRequest, ("Items", "DBCluster"))
+        except ServerException as se:
+            logging.error(se.error_code + " : " + se.message)
+        except ClientException as ce:
+            logging.error(ce.error_code + " : " + ce.message)
+        else:
+            return account_topology(polardb_cluster(one_cluster) for one_cluster in clusters)
+
+    # 初始化本次采集使用的 metrics 快照
+    def init_snapshot(self):
+        self.snapshot = metrics_snapshot()
+        self.event_info = self.snapshot.gauge(
+            "aliyun_polarDB_performance",
+            "this is a performance Guage",
+            ["cluster_id", "node_id", "performance_type", "DBClusterDescription"],
+        )
+        self.event_info_spect = self.snapshot.gauge(
+            "aliyun_polarDB_disk_useage_rate",
+            "this is a performance Guage",
+            ["cluster_id", "performance_type", "DBClusterDescription"],
+            complete=True,
+        )
+        self.cluster_info_p = self.snapshot.gauge(
+            "aliyun_polarDB_meta",
+            "this is a cluster meta info  Guage",
+            [
+                "cluster_ZoneId",
+                "ResourceGroupId",
+                "CreateTime",
+                "DBClusterId",
+                "DBClusterDescription",
+                "DBType",
+                "DBNodeClass",
+                "DBVersion",
+                "node_ZoneId",
+                "DBNodeRole",
+                "RegionId",
+                "DBNodeId",
+            ],
+            complete=True,
+        )
+        # 会变化的集群信息单独输出，不放在 meta 的 label 中
+        self.cluster_status = self.snapshot.gauge(
+            "aliyun_polarDB_cluster_status",
+            "this is a cluster status Guage",
+            ["DBClusterId", "DBClusterDescription", "DBClusterStatus"],
+            complete=True,
+        )
+        self.storage_used = self.snapshot.gauge(
+            "aliyun_polarDB_storage_used_bytes",
+            "this is a cluster storage used Guage",
+            ["DBClusterId", "DBClusterDescription"],
+            complete=True,
+        )
+        self.max_connections = self.snapshot.gauge(
+            "aliyun_polarDB_max_connections",
+            "this is a cluster max connections Guage",
+            ["DBClusterId", "DBClusterDescription"],
+            complete=True,
+        )
+        self.max_storage = self.snapshot.gauge(
+            "aliyun_polarDB_max_storage_gigabytes",
+            "this is a cluster max storage Guage",
+            ["DBClusterId", "DBClusterDescription"],
+            complete=True,
+        )
+        return self.snapshot
+
+    # 采集单个账号，由后台调度线程调用，返回该账号的 metrics 快照
+    def collect(self, account, deadline=None):
+        """
+        :param account: config_file 中的单个账号信息
+        :param deadline: 本次采集的截止时间，超时未完成的查询会被取消
+        :return: metrics_snapshot
+        """
+        snapshot = self.init_snapshot()
+
+        # 初始化账号
+        name, region = account_key(account)
+        client = self.init_client(
+            access_key_id=account["accessKeyId"],
+            access_key_secret=account["accessSecret"],
+            region_id=account["RegionId"],
+            account_name=name,
+        )
+        with collect_phase(account, "inventory"):
+            # 通过账号获取集群信息，清单缓存有效期内不再调用 DescribeDBClusters，也不再重新解析
+            topology = self.inventory.get(account, lambda: self.get_cluster_info(client))
+            # 多副本时只采集本副本分片内的集群，集群下所有节点由同一副本采集
+            topology = topology.owned(self.shard, name)
+
+        # 所有集群下所有节点本次到期的监控项一次性提交到线程池并发查询，热点节点排在最前面
+        nodes = topology.nodes()
+        scopes = [(name, region, one_node.node_id) for _, one_node in nodes]
+        interval = int(account.get("interval", DEFAULT_INTERVAL))
+        with collect_phase(account, "fetch"):
+            tasks = []
+            # 与 tasks 一一对应：(节点下标, 本次请求的监控项)
+            owners = []
+            for index in self.schedule.order(scopes):
+                due = self.schedule.due_keys(scopes[index], self.performance_keys, self.intervals, interval / 2)
+                if not due:
+                    continue
+                # 查询窗口从该节点已取到的最新数据点开始，本次不查询的慢监控项不拉长窗口
+                horizon = max([self.intervals.get(key, 0) for key in due]) + interval * 2
+                start_time = self.watermarks.start_time(scopes[index], self.time_interval, horizon)
+                for key in self.key_groups(due):
+                    tasks.append((client, scopes[index][2], key, self.time_interval, start_time))
+                    owners.append((index, key.split(",")))
+            # 请求在采集间隔的 fetch_spread 比例内均匀提交，热点节点在最前面
+            spread = interval * float(account.get("fetch_spread", DEFAULT_FETCH_SPREAD))
+            responses = self.pool.map(account, self.get_polardb_performance, tasks, deadline, spread)
+
+        with collect_phase(account, "build"):
+            # 生成 meta info ,保存大量集群信息
+            self.save_cluster_info(topology)
+            for one_cluster in topology.clusters:
+                # 生成集群磁盘使用率监控项
+                max_data = self.capacities.get(one_cluster.node_class).max_date
+                disk_rate = int(one_cluster.disk_usage()) / max_data
+                self.event_info_spect.add(
+                    (one_cluster.cluster_id, "disk_useage_rate", one_cluster.description), disk_rate
+                )
+
+            # 按节点整理返回值，查询成功的监控项记录下次到期时间，超过阈值的节点标记为热点
+            node_points = {}
+            for (index, keys), points in zip(owners, responses):
+                if not points:
+                    continue
+                self.schedule.fetched(scopes[index], keys, self.intervals)
+                node_points.setdefault(index, []).extend(points)
+                for one in points:
+                    threshold = self.hot_thresholds.get(one.key)
+                    if threshold is not None and one.value >= threshold:
+                        self.schedule.heat(scopes[index])
+
+            # 按节点依次处理返回值，生成 metrics
+            for index, (one_cluster, one_node) in enumerate(nodes):
+                # 每个节点使用独立的结果缓存，只生成该节点自己的 metrics，
+                # 只保留比上次更新的数据点，没有新数据点、本次未到期的监控项沿用上一次快照
+                performance = []
+                for one in node_points.get(index, ()):
+                    if self.watermarks.advance(scopes[index], one.key, one.timestamp):
+                        performance.append(one)
+                self.init_metrics(
+                    self.event_info,
+                    performance,
+                    one_cluster.cluster_id,
+                    one_node.node_id,
+                    self.capacities.get(one_cluster.node_class),
+                    DBClusterDescription=one_cluster.description,
+                )
+        return snapshot
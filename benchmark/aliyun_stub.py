@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+@desc: 离线压测用的阿里云 api 替身，回放 recorded/ 下录制的返回值，不访问阿里云
+1、recorded_acs_client：替代 AcsClient
+  1.1 按 action 读取 recorded/<action>.json，清单接口按 fleet 大小生成集群/实例并按页返回
+  1.2 性能接口的数据点时间替换为当前时间，每个采集周期都有新的数据点
+  1.3 可配置延迟（latency、jitter）、限流比例（throttle_rate）、错误比例（error_rate）
+  1.4 calls 按 action 记录调用次数（包括被注入限流、错误的请求）
+2、stub_registry：替代 client_registry，返回经过 rate_limiter 的 recorded_acs_client，
+   限速、重试路径与线上一致
+"""
+
+import os
+import copy
+import json
+import time
+import random
+import threading
+
+from aliyunsdkcore.acs_exception.exceptions import ServerException
+
+from aliyun_common import client_registry, limited_client
+
+
+RECORDED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recorded")
+
+
+class recorded_acs_client:
+    def __init__(
+        self,
+        nodes: int,
+        latency: float = 0.02,
+        jitter: float = 0.5,
+        throttle_rate: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = None,
+        recorded_dir: str = RECORDED_DIR,
+    ):
+        """
+        :param nodes: 节点数：PolarDB 每个集群 2 个节点，MongoDB 每个实例算 1 个节点
+        :param latency: 单次请求的平均延迟（单位：秒）
+        :param jitter: 延迟抖动比例，实际延迟在 latency * (1 ± jitter) 之间均匀分布
+        :param throttle_rate: 返回 Throttling.User 的请求比例
+        :param error_rate: 返回 InternalError（5xx）的请求比例
+        :param seed: 随机数种子，便于复现
+        """
+        self.nodes = nodes
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.recorded = {}
+        for file_name in os.listdir(recorded_dir):
+            if file_name.endswith(".json"):
+                with open(os.path.join(recorded_dir, file_name)) as file:
+                    self.recorded[file_name[:-5]] = json.load(file)
+        # {action: 调用次数}
+        self.calls = {}
+        # {(action, 页码, 每页数量): 序列化后的清单}
+        self._rendered = {}
+        # {action: (数据点时间, 序列化后的返回值)}，同一秒内的性能数据相同，只保留最近一秒
+        self._performance = {}
+        self._lock = threading.Lock()
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls = {}
+
+    def do_action_with_exception(self, request):
+        action = request.get_action_name()
+        with self._lock:
+            self.calls[action] = self.calls.get(action, 0) + 1
+            roll = self.random.random()
+            delay = self.latency * (1 + self.jitter * (2 * self.random.random() - 1))
+        if delay > 0:
+            time.sleep(delay)
+        if roll < self.throttle_rate:
+            raise ServerException("Throttling.User", "Request was denied due to user flow control.", 400)
+        if roll < self.throttle_rate + self.error_rate:
+            raise ServerException("InternalError", "The request processing has failed due to some unknown error.", 500)
+
+        params = request.get_query_params()
+        if action == "DescribeDBClusters":
+            return self._clusters(int(params.get("PageNumber", 1)), int(params.get("PageSize", 30)))
+        if action == "DescribeDBInstances":
+            return self._instances(int(params.get("PageNumber", 1)), int(params.get("PageSize", 30)))
+        if action == "DescribeDBNodePerformance":
+            return self._node_performance()
+        if action == "DescribeDBInstancePerformance":
+            return self._instance_performance()
+        raise ServerException("InvalidAction.NotFound", f"没有录制 {action} 的返回值", 404)
+
+    def _page(self, action: str, list_path: tuple, total: int, page_number: int, page_size: int, build):
+        key = (action, page_number, page_size)
+        rendered = self._rendered.get(key)
+        if rendered is None:
+            response = copy.deepcopy(self.recorded[action])
+            container = response
+            for path in list_path[:-1]:
+                container = container[path]
+            template = container[list_path[-1]][0]
+            first = (page_number - 1) * page_size
+            container[list_path[-1]] = [
+                build(copy.deepcopy(template), index) for index in range(first, min(total, first + page_size))
+            ]
+            response["PageNumber"] = page_number
+            response["TotalRecordCount" if "TotalRecordCount" in response else "TotalCount"] = total
+            rendered = self._rendered[key] = json.dumps(response).encode()
+        return rendered
+
+    def _clusters(self, page_number: int, page_size: int):
+        def build(cluster, index):
+            cluster["DBClusterId"] = f"pc-bench{index:06d}"
+            cluster["DBClusterDescription"] = f"bench-cluster-{index}"
+            for number, node in enumerate(cluster["DBNodes"]["DBNode"]):
+                node["DBNodeId"] = f"pi-bench{index:06d}{number}"
+            return cluster
+
+        total = (self.nodes + 1) // 2
+        return self._page("DescribeDBClusters", ("Items", "DBCluster"), total, page_number, page_size, build)
+
+    def _instances(self, page_number: int, page_size: int):
+        def build(instance, index):
+            instance["DBInstanceId"] = f"dds-bench{index:06d}"
+            instance["DBInstanceDescription"] = f"bench-instance-{index}"
+            return instance
+
+        return self._page(
+            "DescribeDBInstances", ("DBInstances", "DBInstance"), self.nodes, page_number, page_size, build
+        )
+
+    def _node_performance(self):
+        now = int(time.time())
+        cached = self._performance.get("DescribeDBNodePerformance")
+        if cached is None or cached[0] != now:
+            response = copy.deepcopy(self.recorded["DescribeDBNodePerformance"])
+            for item in response["PerformanceKeys"]["PerformanceItem"]:
+                points = item["Points"]["PerformanceItemValue"]
+                for offset, point in enumerate(reversed(points)):
+                    point["Timestamp"] = (now - offset * 60) * 1000
+            cached = self._performance["DescribeDBNodePerformance"] = (now, json.dumps(response).encode())
+        return cached[1]
+
+    def _instance_performance(self):
+        now = int(time.time())
+        cached = self._performance.get("DescribeDBInstancePerformance")
+        if cached is None or cached[0] != now:
+            response = copy.deepcopy(self.recorded["DescribeDBInstancePerformance"])
+            for performance_key in response["PerformanceKeys"]["PerformanceKey"]:
+                points = performance_key["PerformanceValues"]["PerformanceValue"]
+                for offset, point in enumerate(reversed(points)):
+                    point["Date"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now - offset * 60))
+            cached = self._performance["DescribeDBInstancePerformance"] = (now, json.dumps(response).encode())
+        return cached[1]
+
+
+class stub_registry(client_registry):
+    """
+    所有账号、区域共用同一个 recorded_acs_client，请求仍经过 rate_limiter
+    """
+
+    def __init__(self, stub: recorded_acs_client, **kwargs):
+        super().__init__(**kwargs)
+        self.stub = stub
+
+    def get(self, key_id: str, secret: str, region: str, account: str = None):
+        return limited_client(self.stub, self.limiter, key_id, account)
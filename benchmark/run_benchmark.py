@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+@desc: 采集路径离线压测，使用 aliyun_stub 回放录制的返回值，不消耗阿里云 api 配额
+1、每个规模（节点数）在独立子进程中运行，峰值内存互不影响
+2、输出：
+  2.1 cycle：每个采集周期耗时，第一个周期包含清单拉取，之后清单走缓存
+  2.2 calls：每个采集周期的 api 调用次数（包括重试）；周期之间 time.time 前进 --interval 秒，
+      cold_interval、key_intervals 按真实的采集间隔生效，steady 反映稳定后的调用次数
+  2.3 series：快照中的 series 数
+  2.4 render：预渲染（text + gzip）耗时，以及 openmetrics 首次渲染耗时
+  2.5 peak_rss：进程峰值内存
+3、用法（在仓库根目录运行）：
+  python benchmark/run_benchmark.py --product polardb --sizes 10,100,1000,10000
+  python benchmark/run_benchmark.py --product mongodb --latency 0.05 --throttle-rate 0.02 --error-rate 0.01
+  --json 输出每个规模一行 json，便于与之前的结果对比
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_rss_mb():
+    """
+    :return: 当前进程的峰值内存（单位：MB），linux 下 ru_maxrss 单位为 KB，macOS 下为字节
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def run_single(args):
+    """
+    在当前进程中压测单个规模，返回结果字典
+    """
+    from aliyun_common import collect_scheduler, fetch_pool, product_collector, rate_limiter
+    from aliyun_exporter import load_product
+    from aliyun_stub import recorded_acs_client, stub_registry
+
+    stub = recorded_acs_client(
+        args.single,
+        latency=args.latency,
+        jitter=args.jitter,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    pool = fetch_pool(args.max_workers, args.account_limit, args.region_limit)
+    limiter = rate_limiter(qps=args.qps, base_delay=args.retry_base_delay)
+    clients = stub_registry(stub, pool_size=args.account_limit, limiter=limiter)
+    collector = product_collector([load_product(args.product)], pool=pool, clients=clients)
+    account = {
+        "product": args.product,
+        "name": "bench",
+        "accessKeyId": "bench",
+        "accessSecret": "bench",
+        "RegionId": "cn-hangzhou",
+        "timeout": 3600,
+        "interval": args.interval,
+        # 请求不按采集间隔错开提交
+        "fetch_spread": 0,
+    }
+    scheduler = collect_scheduler(collector, [account])
+
+    # 周期之间不真正等待，只让 time.time 前进一个采集间隔，time.sleep 与 perf_counter 不受影响
+    real_time = time.time
+    skipped = [0.0]
+    time.time = lambda: real_time() + skipped[0]
+
+    cycles = []
+    for _ in range(args.cycles):
+        stub.reset_calls()
+        started = time.perf_counter()
+        scheduler.collect_once(account)
+        cycles.append({
+            "seconds": round(time.perf_counter() - started, 4),
+            "calls": sum(stub.calls.values()),
+            "up": list(scheduler.status().values())[0][0],
+        })
+        skipped[0] += args.interval
+
+    # collect_once 只标记需要重新渲染，渲染由后台线程完成，这里单独计时
+    started = time.perf_counter()
+    for _ in range(args.render_rounds):
+        scheduler.exposition.refresh()
+    render = (time.perf_counter() - started) / args.render_rounds
+    started = time.perf_counter()
+    scheduler.exposition.get(True)
+    render_openmetrics = time.perf_counter() - started
+    status, headers, chunks = scheduler.exposition.response(use_gzip=True)
+
+    snapshot = list(scheduler.snapshots().values())[0][0]
+    return {
+        "product": args.product,
+        "nodes": args.single,
+        "cycles": cycles,
+        "series": sum(len(family.values) for family in snapshot.families.values()),
+        "render_seconds": round(render, 4),
+        "render_openmetrics_seconds": round(render_openmetrics, 4),
+        "body_bytes": len(scheduler.exposition.get(False)[0]),
+        "gzip_bytes": int(headers["Content-Length"]),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def print_table(results: list):
+    print(f"{'nodes':>7} {'first':>9} {'steady':>9} {'calls':>13} {'series':>8} "
+          f"{'render':>8} {'om':>8} {'gzip KB':>9} {'rss MB':>8}")
+    for result in results:
+        cycles = result["cycles"]
+        steady = cycles[1:] or cycles
+        steady_seconds = sum(cycle["seconds"] for cycle in steady) / len(steady)
+        failed = "" if all(cycle["up"] for cycle in cycles) else " (failed)"
+        print(
+            f"{result['nodes']:>7} {cycles[0]['seconds']:>8.3f}s {steady_seconds:>8.3f}s "
+            f"{cycles[0]['calls']:>6}/{steady[-1]['calls']:<6} {result['series']:>8} "
+            f"{result['render_seconds']:>7.4f}s {result['render_openmetrics_seconds']:>7.4f}s "
+            f"{result['gzip_bytes'] / 1024:>9.1f} {result['peak_rss_mb']:>8.1f}{failed}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--product", default="polardb", help="压测的产品：polardb、mongodb")
+    parser.add_argument("--sizes", default="10,100,1000,10000", help="节点数，逗号分隔")
+    parser.add_argument("--cycles", type=int, default=3, help="每个规模的采集周期数")
+    parser.add_argument("--interval", type=int, default=60, help="采集间隔，周期之间 time.time 前进的秒数")
+    parser.add_argument("--latency", type=float, default=0.02, help="单次请求平均延迟（单位：秒）")
+    parser.add_argument("--jitter", type=float, default=0.5, help="延迟抖动比例")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="限流比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="5xx 错误比例")
+    parser.add_argument("--seed", type=int, default=1, help="随机数种子")
+    parser.add_argument("--qps", type=float, default=1000, help="单个 (accessKeyId, action) 限速，默认不成为瓶颈")
+    parser.add_argument("--retry-base-delay", type=float, default=0.05, help="第一次重试的最大等待时间（单位：秒）")
+    parser.add_argument("--max-workers", type=int, default=32, help="线程池总并发数")
+    parser.add_argument("--account-limit", type=int, default=32, help="单账号并发数")
+    parser.add_argument("--region-limit", type=int, default=32, help="单区域并发数")
+    parser.add_argument("--render-rounds", type=int, default=5, help="预渲染计时的重复次数")
+    parser.add_argument("--json", action="store_true", help="每个规模输出一行 json")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print(json.dumps(run_single(args)))
+        return
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(",") if size.strip()]:
+        # 每个规模单独一个子进程，峰值内存只反映该规模
+        command = [sys.executable, os.path.abspath(__file__), "--single", str(size)]
+        for name, value in vars(args).items():
+            if name in ("sizes", "single", "json") or value is None:
+                continue
+            command += [f"--{name.replace('_', '-')}", str(value)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        if args.json:
+            print(json.dumps(result), flush=True)
+    if not args.json:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+# encoding: utf-8
+"""
+@desc: 测试在仓库根目录之外运行时，也能导入 aliyun_common 等模块
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,87 @@
+# encoding: utf-8
+"""
+@desc: counter_store、metric_mapping transform 测试
+1、rate：取值变小视为重置，间隔超过 max_gap 只作为新的起点，重复时间的数据点被忽略
+2、integrate：查询窗口内的全部数据点逐点累加，已累加过的数据点被跳过
+3、integrate 条目输出 counter，名称追加 _total
+"""
+
+import pytest
+from prometheus_client import generate_latest
+
+from aliyun_common import counter_store, metric_mapping, metrics_snapshot, snapshot_families
+
+SERIES = ("aliyun_mongodb_opcounters", ("dds-1", "insert"))
+
+
+def test_rate_handles_counter_reset():
+    counters = counter_store()
+    assert counters.rate(SERIES, 100, 1000) is None
+    assert counters.rate(SERIES, 160, 1060) == pytest.approx(1.0)
+    # 实例重启后计数器从 0 开始
+    assert counters.rate(SERIES, 30, 1120) == pytest.approx(0.5)
+
+
+def test_gap_over_max_gap_restarts():
+    counters = counter_store(max_gap=300)
+    assert counters.integrate(SERIES, 2, 1000) == 0
+    assert counters.integrate(SERIES, 2, 1060) == pytest.approx(120)
+    # 间隔超过 max_gap 时不累加，只作为新的起点
+    assert counters.integrate(SERIES, 2, 1460) == pytest.approx(120)
+    assert counters.integrate(SERIES, 1, 1520) == pytest.approx(180)
+    assert counters.rate(("rate",), 10, 1000) is None
+    assert counters.rate(("rate",), 20, 1400) is None
+
+
+def test_duplicate_timestamps_are_ignored():
+    counters = counter_store()
+    counters.integrate(SERIES, 2, 1000)
+    assert counters.integrate(SERIES, 2, 1060) == pytest.approx(120)
+    assert counters.integrate(SERIES, 5, 1060) == pytest.approx(120)
+    assert counters.integrate(SERIES, 5, 1000) == pytest.approx(120)
+    counters.rate(("rate",), 10, 1000)
+    assert counters.rate(("rate",), 20, 1000) is None
+
+
+def build_mapping():
+    return metric_mapping([
+        {"key": "MongoDB_Opcounters", "name": "aliyun_mongodb_opcounters", "value_format_label": "operation",
+         "transform": "integrate"},
+        {"key": "CpuUsage", "name": "aliyun_mongodb_metrics_cpu_usage"},
+    ], ("db_instance_id",))
+
+
+def test_integrate_uses_every_point_in_window():
+    mapping = build_mapping()
+    assert mapping.integrated_keys == {"MongoDB_Opcounters"}
+    counters = counter_store()
+    snapshot = metrics_snapshot()
+    mapping.add(snapshot, ("dds-1",), "MongoDB_Opcounters", "insert&query", (1.0, 0.0), 1000, counters)
+    # 下一个周期返回 3 个新数据点，每个都按与前一个数据点的间隔累加
+    earlier = (((2.0, 1.0), 1060), ((4.0, None), 1120))
+    mapping.add(snapshot, ("dds-1",), "MongoDB_Opcounters", "insert&query", (6.0, 3.0), 1180, counters, earlier)
+
+    family = snapshot.families["aliyun_mongodb_opcounters"]
+    assert family.metric_type == "counter"
+    values = dict(zip(family.labelvalues, family.values))
+    assert values[("dds-1", "insert")] == pytest.approx(2 * 60 + 4 * 60 + 6 * 60)
+    assert values[("dds-1", "query")] == pytest.approx(1 * 60 + 3 * 120)
+
+    # 窗口与上一次重叠时，已累加过的数据点被跳过
+    mapping.add(snapshot, ("dds-1",), "MongoDB_Opcounters", "insert&query", (1.0, 1.0), 1240, counters,
+                (((6.0, 3.0), 1180),))
+    assert counters.integrate(("aliyun_mongodb_opcounters", ("dds-1", "insert")), 1.0, 1240) == pytest.approx(780)
+
+
+def test_integrate_counter_name_gets_total():
+    snapshot = metrics_snapshot()
+    build_mapping().add(snapshot, ("dds-1",), "MongoDB_Opcounters", "insert", (1.0,), 1000, counter_store())
+    snapshot.seal(1000)
+
+    class collector:
+        def collect(self):
+            return snapshot_families([(snapshot, 1000)], 1000).values()
+
+    lines = generate_latest(collector()).decode().splitlines()
+    assert any(line.startswith('aliyun_mongodb_opcounters_total{db_instance_id="dds-1",operation="insert"}')
+               for line in lines)
@@ -0,0 +1,54 @@
+# encoding: utf-8
+"""
+@desc: exposition_cache 测试
+1、两次预渲染之间，带上次 ETag 的请求返回 304
+2、预渲染更新后 ETag 变化，text、openmetrics 格式的 ETag 各自独立
+3、gzip 压缩后的内容与文本一致，openmetrics 格式以 # EOF 结尾
+"""
+
+import gzip
+
+from prometheus_client import CollectorRegistry, Gauge
+
+from aliyun_common import exposition_cache
+
+
+def build():
+    registry = CollectorRegistry(auto_describe=True)
+    gauge = Gauge("aliyun_test_value", "test value", registry=registry)
+    exposition = exposition_cache(registry)
+    exposition.refresh()
+    return gauge, exposition
+
+
+def test_same_render_returns_304():
+    _, exposition = build()
+    status, headers, chunks = exposition.response()
+    assert status == 200
+    status, again, chunks = exposition.response(if_none_match=headers["ETag"])
+    assert (status, again["ETag"], chunks) == (304, headers["ETag"], [])
+
+
+def test_refresh_changes_etag():
+    gauge, exposition = build()
+    _, headers, _ = exposition.response()
+    gauge.set(1)
+    # 只有预渲染更新后内容才变化
+    assert exposition.response(if_none_match=headers["ETag"])[0] == 304
+    exposition.refresh()
+    status, refreshed, chunks = exposition.response(if_none_match=headers["ETag"])
+    assert status == 200
+    assert refreshed["ETag"] != headers["ETag"]
+    assert b"aliyun_test_value 1.0" in b"".join(chunks)
+
+
+def test_gzip_and_openmetrics():
+    _, exposition = build()
+    _, headers, chunks = exposition.response(use_gzip=True)
+    assert headers["Content-Encoding"] == "gzip"
+    assert int(headers["Content-Length"]) == len(b"".join(chunks))
+    assert gzip.decompress(b"".join(chunks)) == exposition.get(False)[0]
+
+    _, om_headers, chunks = exposition.response(accept="application/openmetrics-text")
+    assert om_headers["ETag"] != headers["ETag"]
+    assert b"".join(chunks).endswith(b"# EOF\n")
@@ -0,0 +1,304 @@
+# encoding: utf-8
+"""
+@desc: 推送模式测试，推送到本地 http.server 启动的接收端，不依赖 prometheus、Pushgateway
+1、remote_writer：解码 snappy、WriteRequest，检查 label、取值、时间戳、分批
+2、pushgateway_pusher：采集成功 PUT 整组替换，失败 POST 只更新 up
+3、push_queue：可重试错误退避重试，不可重试错误不重试，队列满时丢弃最早的请求
+"""
+
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from aliyun_common import (
+    metrics_snapshot,
+    push_queue,
+    pushgateway_pusher,
+    remote_writer,
+    shard_filter,
+)
+
+KEY = ("polardb", "prod", "cn-hangzhou")
+
+
+class receiver:
+    """
+    本地接收端，记录收到的请求，按 statuses 依次返回状态码，用完后返回 200
+    """
+
+    def __init__(self, statuses=()):
+        self.requests = []
+        self.statuses = list(statuses)
+        self._lock = threading.Lock()
+        owner = self
+
+        class handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with owner._lock:
+                    owner.requests.append((self.command, self.path, dict(self.headers), body))
+                    status = owner.statuses.pop(0) if owner.statuses else 200
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            do_POST = do_PUT = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def wait(self, count: int, timeout: float = 5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._lock:
+                if len(self.requests) >= count:
+                    return list(self.requests)
+            time.sleep(0.01)
+        raise AssertionError(f"只收到 {len(self.requests)} 个请求，期望 {count} 个")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def server():
+    one = receiver()
+    yield one
+    one.close()
+
+
+@pytest.fixture
+def queue():
+    return push_queue(max_in_flight=1, base_delay=0.01, max_delay=0.01, timeout=5)
+
+
+def read_varint(data: bytes, offset: int):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, offset
+
+
+def snappy_decompress(data: bytes):
+    """
+    snappy block 格式解压，与是否安装 python-snappy 无关
+    """
+    length, offset = read_varint(data, 0)
+    out = bytearray()
+    while offset < len(data):
+        tag = data[offset]
+        offset += 1
+        if tag & 3 == 0:
+            size = tag >> 2
+            if size >= 60:
+                extra = size - 59
+                size = int.from_bytes(data[offset:offset + extra], "little")
+                offset += extra
+            size += 1
+            out += data[offset:offset + size]
+            offset += size
+            continue
+        if tag & 3 == 1:
+            size = ((tag >> 2) & 7) + 4
+            distance = ((tag >> 5) << 8) | data[offset]
+            offset += 1
+        else:
+            extra = 2 if tag & 3 == 2 else 4
+            size = (tag >> 2) + 1
+            distance = int.from_bytes(data[offset:offset + extra], "little")
+            offset += extra
+        for _ in range(size):
+            out.append(out[-distance])
+    assert len(out) == length
+    return bytes(out)
+
+
+def parse_fields(data: bytes):
+    """
+    :return: [(字段编号, 取值), ...]，只处理 WriteRequest 用到的 varint、fixed64、length-delimited
+    """
+    fields = []
+    offset = 0
+    while offset < len(data):
+        key, offset = read_varint(data, offset)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, offset = read_varint(data, offset)
+        elif wire_type == 1:
+            value = data[offset:offset + 8]
+            offset += 8
+        elif wire_type == 2:
+            size, offset = read_varint(data, offset)
+            value = data[offset:offset + size]
+            offset += size
+        else:
+            raise AssertionError(f"不支持的 wire type {wire_type}")
+        fields.append((number, value))
+    return fields
+
+
+def decode_write_request(body: bytes):
+    """
+    :return: [(((label 名称, label 取值), ...), value, 时间戳（毫秒）), ...]
+    """
+    series = []
+    for _, timeseries in parse_fields(snappy_decompress(body)):
+        labels, samples = [], []
+        for number, value in parse_fields(timeseries):
+            if number == 1:
+                label = dict(parse_fields(value))
+                labels.append((label[1].decode(), label[2].decode()))
+            else:
+                sample = dict(parse_fields(value))
+                samples.append((struct.unpack("<d", sample[1])[0], sample[2]))
+        assert len(samples) == 1
+        series.append((tuple(labels), samples[0][0], samples[0][1]))
+    return series
+
+
+def build_snapshot(finished: float):
+    snapshot = metrics_snapshot()
+    performance = snapshot.gauge("aliyun_polarDB_performance", "performance", ["cluster_id", "performance_type"])
+    performance.add(("pc-1", "cpu_ratio"), 12.5, 1700000000.0)
+    performance.add(("pc-1", "mem_ratio"), 40, None)
+    snapshot.seal(finished)
+    return snapshot
+
+
+def test_remote_writer_encodes_series(server, queue):
+    queue.start()
+    finished = 1700000060.25
+    writer = remote_writer(server.url + "/api/v1/write", queue, "aliyun_polardb", shard=shard_filter(1, 2))
+    writer.push(KEY, build_snapshot(finished), finished)
+
+    method, path, headers, body = server.wait(1)[0]
+    assert (method, path) == ("POST", "/api/v1/write")
+    assert headers["Content-Encoding"] == "snappy"
+    assert headers["Content-Type"] == "application/x-protobuf"
+    assert headers["X-Prometheus-Remote-Write-Version"] == "0.1.0"
+
+    series = {dict(labels)["__name__"] + "/" + dict(labels).get("performance_type", ""): (labels, value, timestamp)
+              for labels, value, timestamp in decode_write_request(body)}
+    labels, value, timestamp = series["aliyun_polarDB_performance/cpu_ratio"]
+    assert labels == (
+        ("__name__", "aliyun_polarDB_performance"), ("cluster_id", "pc-1"),
+        ("job", "aliyun_polardb"), ("performance_type", "cpu_ratio"),
+    )
+    # 有数据点时间时使用数据点时间，没有时使用采集完成时间
+    assert (value, timestamp) == (12.5, 1700000000000)
+    assert series["aliyun_polarDB_performance/mem_ratio"][1:] == (40.0, 1700000060250)
+    labels, value, timestamp = series["aliyun_exporter_account_up/"]
+    assert dict(labels) == {
+        "__name__": "aliyun_exporter_account_up", "job": "aliyun_polardb", "product": "polardb",
+        "account": "prod", "region": "cn-hangzhou", "shard": "1",
+    }
+    assert list(labels) == sorted(labels)
+    assert (value, timestamp) == (1.0, 1700000060250)
+
+
+def test_remote_writer_batches_and_skips_carried_series(server, queue):
+    queue.start()
+    previous = build_snapshot(1700000000.0)
+    snapshot = metrics_snapshot()
+    snapshot.gauge("aliyun_polarDB_performance", "performance", ["cluster_id", "performance_type"]).add(
+        ("pc-1", "cpu_ratio"), 13, None
+    )
+    snapshot.seal(1700000060.0)
+    snapshot.carry_over(previous, 1700000060.0)
+    assert len(snapshot.families["aliyun_polarDB_performance"].values) == 2
+
+    writer = remote_writer(server.url, queue, "aliyun_polardb", batch_size=1)
+    writer.push(KEY, snapshot, 1700000060.0)
+
+    # 沿用的 mem_ratio 已经推送过，本周期只发送 cpu_ratio 和 up，每批 1 个 series
+    requests = server.wait(2)
+    time.sleep(0.1)
+    assert len(server.requests) == 2
+    names = sorted(dict(decode_write_request(body)[0][0])["__name__"] for _, _, _, body in requests)
+    assert names == ["aliyun_exporter_account_up", "aliyun_polarDB_performance"]
+
+
+def test_remote_writer_counter_names_match_exposition(server, queue):
+    queue.start()
+    snapshot = metrics_snapshot()
+    snapshot.family("aliyun_mongodb_opcounters", "opcounters", ["instance_id"], "counter").add(("dds-1",), 60)
+    snapshot.seal(1700000060.0)
+    remote_writer(server.url, queue, "aliyun_mongodb").push(KEY, snapshot, 1700000060.0)
+
+    names = {dict(labels)["__name__"] for labels, _, _ in decode_write_request(server.wait(1)[0][3])}
+    assert names == {"aliyun_mongodb_opcounters_total", "aliyun_exporter_account_up"}
+
+
+def test_remote_writer_failed_collection_pushes_up_only(server, queue):
+    queue.start()
+    remote_writer(server.url, queue, "aliyun_polardb").push(KEY, None, 1700000060.0)
+    series = decode_write_request(server.wait(1)[0][3])
+    assert len(series) == 1
+    assert dict(series[0][0])["__name__"] == "aliyun_exporter_account_up"
+    assert series[0][1] == 0.0
+
+
+def test_pushgateway_put_on_success_post_on_failure(server, queue):
+    queue.start()
+    pusher = pushgateway_pusher(server.url + "/", queue, "aliyun_polardb", shard=shard_filter(0, 2))
+    pusher.push(KEY, build_snapshot(1700000060.0), 1700000060.0)
+    pusher.push(KEY, None, 1700000120.0)
+
+    (put, put_path, _, put_body), (post, post_path, _, post_body) = server.wait(2)
+    group = "/metrics/job/aliyun_polardb/aliyun_product/polardb/aliyun_account/prod/aliyun_region/cn-hangzhou/shard/0"
+    assert (put, put_path) == ("PUT", group)
+    assert (post, post_path) == ("POST", group)
+
+    lines = put_body.decode().splitlines()
+    assert 'aliyun_polarDB_performance{cluster_id="pc-1",performance_type="cpu_ratio"} 12.5' in lines
+    assert 'aliyun_exporter_account_up{account="prod",product="polardb",region="cn-hangzhou"} 1.0' in lines
+    # Pushgateway 不接受带时间戳的数据
+    assert not any(line.endswith("1700000000000") for line in lines)
+
+    lines = post_body.decode().splitlines()
+    assert 'aliyun_exporter_account_up{account="prod",product="polardb",region="cn-hangzhou"} 0.0' in lines
+    assert not any(line.startswith("aliyun_polarDB_performance") for line in lines)
+
+
+@pytest.mark.parametrize(
+    "statuses, max_retries, requests, sent, failed",
+    [
+        ((503, 429), 3, 3, 1, 0),
+        ((500, 500, 500), 2, 3, 0, 1),
+        ((400,), 3, 1, 0, 1),
+    ],
+)
+def test_push_queue_retries(statuses, max_retries, requests, sent, failed):
+    one = receiver(statuses)
+    try:
+        queue = push_queue(max_retries=max_retries, base_delay=0.01, max_delay=0.01, timeout=5)
+        assert queue.send(one.url, b"data", {}) is bool(sent)
+        assert len(one.requests) == requests
+        assert (queue.sent, queue.failed) == (sent, failed)
+    finally:
+        one.close()
+
+
+def test_push_queue_drops_oldest_when_full(server):
+    queue = push_queue(max_in_flight=1, max_pending=2, timeout=5)
+    for number in range(3):
+        queue.put(f"{server.url}/{number}", b"data", {})
+    assert (queue.dropped, queue.pending()) == (1, 2)
+
+    queue.start()
+    server.wait(2)
+    time.sleep(0.1)
+    assert [path for _, path, _, _ in server.requests] == ["/1", "/2"]
+    assert queue.sent == 2
@@ -0,0 +1,156 @@
+# encoding: utf-8
+"""
+@desc: 按监控项刷新、热点节点、分散提交的测试，使用 benchmark/aliyun_stub 回放录制的返回值
+1、hot_thresholds 的名称与返回值中的 MetricName/Key 一致，超过阈值的节点被标记为热点
+2、cold_interval、key_intervals 减少每个周期的请求数，热点节点每个周期都查询
+3、fetch_pool.map 在 spread 秒内均匀提交，等待时长记为 pace 阶段，不计入 fetch 阶段
+4、batch_keys 合并的请求，请求耗时的 key label 为空
+"""
+
+import json
+import os
+import sys
+import time
+
+import pytest
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmark")
+sys.path.insert(0, BENCHMARK_DIR)
+
+from aliyun_common import collect_phase, fetch_pool, rate_limiter, refresh_schedule, self_registry
+from aliyun_mongodb import aliyun_mongodb
+from aliyun_polardb import aliyun_polarDB_api
+from aliyun_stub import recorded_acs_client, stub_registry
+
+
+def recorded(action: str):
+    with open(os.path.join(BENCHMARK_DIR, "recorded", action + ".json")) as file:
+        return json.load(file)
+
+
+class clock:
+    """
+    可手动前进的 time.time
+    """
+
+    def __init__(self, now: float = 1700000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def stub_clients(stub: recorded_acs_client):
+    # 不限速，time.time 被替换时令牌桶也不会等待
+    return stub_registry(stub, limiter=rate_limiter(qps=1e9))
+
+
+def stub_account(product: str):
+    return {
+        "product": product, "name": "test", "accessKeyId": "test", "accessSecret": "test",
+        "RegionId": "cn-hangzhou", "fetch_spread": 0,
+    }
+
+
+def test_hot_threshold_names_match_responses():
+    items = recorded("DescribeDBNodePerformance")["PerformanceKeys"]["PerformanceItem"]
+    assert set(aliyun_polarDB_api.hot_thresholds) <= {item["MetricName"] for item in items}
+    items = recorded("DescribeDBInstancePerformance")["PerformanceKeys"]["PerformanceKey"]
+    assert set(aliyun_mongodb.hot_thresholds) <= {item["Key"] for item in items}
+
+
+@pytest.mark.parametrize("threshold, hot", [(5, True), (50, False)])
+def test_polardb_node_over_threshold_is_hot(threshold, hot):
+    # 录制的 mean_cpu_ratio 为 8.12
+    stub = recorded_acs_client(4, latency=0)
+    schedule = refresh_schedule()
+    plugin = aliyun_polarDB_api(clients=stub_clients(stub), schedule=schedule)
+    plugin.hot_thresholds = {"mean_cpu_ratio": threshold}
+    plugin.collect(stub_account("polardb"))
+
+    node_ids = [f"pi-bench{index:06d}{number}" for index in range(2) for number in range(2)]
+    assert [schedule.is_hot(("test", "cn-hangzhou", node_id)) for node_id in node_ids] == [hot] * 4
+
+
+def test_cold_nodes_skip_calls_between_refreshes(monkeypatch):
+    now = clock()
+    monkeypatch.setattr(time, "time", now)
+    stub = recorded_acs_client(200, latency=0)
+    schedule = refresh_schedule()
+    plugin = aliyun_polarDB_api(clients=stub_clients(stub), schedule=schedule)
+    account = stub_account("polardb")
+
+    calls = []
+    for _ in range(8):
+        stub.reset_calls()
+        plugin.collect(account)
+        calls.append(stub.calls.get("DescribeDBNodePerformance", 0))
+        now.now += 60
+    # 第一个周期查询全部节点，之后非热点节点按 cold_interval（120s）错开，每个周期约一半
+    assert calls[0] == 200
+    assert all(60 <= count <= 140 for count in calls[3:]), calls
+    assert sum(calls[4:]) == pytest.approx(400, rel=0.1)
+
+
+def test_hot_nodes_are_fetched_every_cycle(monkeypatch):
+    now = clock()
+    monkeypatch.setattr(time, "time", now)
+    stub = recorded_acs_client(20, latency=0)
+    plugin = aliyun_polarDB_api(clients=stub_clients(stub), schedule=refresh_schedule())
+    plugin.hot_thresholds = {"mean_cpu_ratio": 0}
+
+    for _ in range(3):
+        stub.reset_calls()
+        plugin.collect(stub_account("polardb"))
+        assert stub.calls["DescribeDBNodePerformance"] == 20
+        now.now += 60
+
+
+def test_node_keys_align_into_one_call():
+    schedule = refresh_schedule()
+    intervals = refresh_schedule.intervals(("cpu", "disk"), {"disk": 240}, 120)
+    assert intervals == {"cpu": 120, "disk": 240}
+    scope = ("test", "cn-hangzhou", "pi-1")
+    schedule.fetched(scope, ["cpu", "disk"], intervals)
+    due = schedule._due[scope][0]
+    # 同一节点的哈希相同，disk 的到期时间与 cpu 相同或晚一个 cold_interval
+    assert (due["disk"] - due["cpu"]) % 120 == pytest.approx(0, abs=1e-6)
+
+
+def test_fetch_pool_map_spreads_submissions():
+    pool = fetch_pool(max_workers=4)
+    submitted = []
+    results = pool.map({"name": "test", "RegionId": "cn-hangzhou"},
+                       lambda number: submitted.append(time.time()) or number, [(n,) for n in range(4)], spread=0.4)
+    assert results == [0, 1, 2, 3]
+    gaps = [later - earlier for earlier, later in zip(submitted, submitted[1:])]
+    assert all(gap >= 0.08 for gap in gaps), gaps
+
+
+def test_pacing_is_not_counted_in_fetch_phase():
+    account = {"product": "polardb", "name": "pace", "RegionId": "cn-hangzhou"}
+    with collect_phase(account, "fetch"):
+        fetch_pool(max_workers=4).map(account, lambda number: number, [(n,) for n in range(4)], spread=0.4)
+    phases = {
+        phase: self_registry.get_sample_value("aliyun_exporter_collect_phase_duration_seconds", {
+            "product": "polardb", "account": "pace", "region": "cn-hangzhou", "phase": phase,
+        })
+        for phase in ("fetch", "pace")
+    }
+    assert phases["pace"] >= 0.25
+    assert phases["fetch"] < 0.1
+
+
+def test_batched_request_duration_has_empty_key():
+    stub = recorded_acs_client(2, latency=0)
+    plugin = aliyun_mongodb(clients=stub_clients(stub))
+    plugin.batch_keys = True
+    plugin.collect(stub_account("mongodb"))
+
+    keys = {
+        sample.labels["key"] for metric in self_registry.collect() for sample in metric.samples
+        if metric.name == "aliyun_exporter_api_request_duration_seconds"
+        and sample.labels.get("action") == "DescribeDBInstancePerformance"
+    }
+    assert "" in keys
+    assert not any("," in key for key in keys)
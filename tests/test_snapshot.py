@@ -0,0 +1,29 @@
+# encoding: utf-8
+"""
+@desc: metrics_snapshot 跨周期合并测试
+1、普通 family 沿用本周期未采到的 series
+2、complete 的 family（由清单生成的状态、meta）不沿用，状态变化后旧的 label 组合立即消失
+"""
+
+from aliyun_common import metrics_snapshot
+
+
+def build(status: str, performance: bool, finished: float):
+    snapshot = metrics_snapshot()
+    snapshot.gauge("aliyun_polarDB_cluster_status", "status", ["DBClusterId", "DBClusterStatus"], complete=True).add(
+        ("pc-1", status), 1
+    )
+    family = snapshot.gauge("aliyun_polarDB_performance", "performance", ["cluster_id", "performance_type"])
+    if performance:
+        family.add(("pc-1", "cpu_ratio"), 10)
+    snapshot.seal(finished)
+    return snapshot
+
+
+def test_complete_family_is_not_carried_over():
+    previous = build("Running", True, 1700000000.0)
+    snapshot = build("Stopping", False, 1700000060.0)
+    snapshot.carry_over(previous, 1700000060.0)
+
+    assert snapshot.families["aliyun_polarDB_cluster_status"].labelvalues == [("pc-1", "Stopping")]
+    assert snapshot.families["aliyun_polarDB_performance"].labelvalues == [("pc-1", "cpu_ratio")]
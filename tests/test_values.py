@@ -0,0 +1,66 @@
+# encoding: utf-8
+"""
+@desc: 性能接口返回非数字取值的测试，使用 benchmark/aliyun_stub 回放录制的返回值
+1、PolarDB Value 为 null、MongoDB Value 为 N/A 时只丢弃该监控项，账号照常采集
+2、parse_values 解析 MongoDB 以 & 分隔的取值
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmark"))
+
+from aliyun_common import parse_values, rate_limiter
+from aliyun_mongodb import aliyun_mongodb
+from aliyun_polardb import aliyun_polarDB_api
+from aliyun_stub import recorded_acs_client, stub_registry
+
+
+def stub_account(product: str):
+    return {
+        "product": product, "name": "test", "accessKeyId": "test", "accessSecret": "test",
+        "RegionId": "cn-hangzhou", "fetch_spread": 0,
+    }
+
+
+def set_newest(points: list, value):
+    # 回放时最后一个数据点为最新
+    points[-1]["Value"] = value
+
+
+def test_polardb_null_value_is_dropped():
+    stub = recorded_acs_client(2, latency=0)
+    for item in stub.recorded["DescribeDBNodePerformance"]["PerformanceKeys"]["PerformanceItem"]:
+        if item["MetricName"] == "mean_cpu_ratio":
+            set_newest(item["Points"]["PerformanceItemValue"], None)
+    plugin = aliyun_polarDB_api(clients=stub_registry(stub, limiter=rate_limiter(qps=1e9)))
+    snapshot = plugin.collect(stub_account("polardb"))
+
+    types = {labelvalues[2] for labelvalues in snapshot.families["aliyun_polarDB_performance"].labelvalues}
+    assert "mean_cpu_ratio" not in types
+    assert "mean_active_session" in types
+
+
+def test_mongodb_not_available_value_is_dropped():
+    stub = recorded_acs_client(2, latency=0)
+    for performance_key in stub.recorded["DescribeDBInstancePerformance"]["PerformanceKeys"]["PerformanceKey"]:
+        if performance_key["Key"] == "CpuUsage":
+            set_newest(performance_key["PerformanceValues"]["PerformanceValue"], "N/A")
+    plugin = aliyun_mongodb(clients=stub_registry(stub, limiter=rate_limiter(qps=1e9)))
+    snapshot = plugin.collect(stub_account("mongodb"))
+
+    assert "aliyun_mongodb_metrics_cpu_usage" not in snapshot.families
+    assert len(snapshot.families["aliyun_mongodb_metrics_memory_usage"].values) == 2
+
+
+@pytest.mark.parametrize("value, parsed", [("27.62", (27.62,)), ("0.1&&3", (0.1, None, 3.0))])
+def test_parse_values(value, parsed):
+    assert parse_values(value) == parsed
+
+
+@pytest.mark.parametrize("value", ["N/A", "1&N/A", None])
+def test_parse_values_rejects_non_numbers(value):
+    with pytest.raises((TypeError, ValueError, AttributeError)):
+        parse_values(value)